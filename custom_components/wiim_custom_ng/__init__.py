@@ -1,25 +1,22 @@
-import logging
-import voluptuous as vol
-
-from homeassistant.components.media_player.const import MediaType
-from homeassistant.helpers import config_validation as cv
-from homeassistant.const import ATTR_ENTITY_ID
-from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant
-
 from .const import *
-from .media_player import WiiMData
+
+# Home Assistant is only imported within the functions, so the protocol modules (client,
+# fleet, soak) can be imported without it.
 
 # List the platforms that your integration supports.
 PLATFORMS = ["media_player"]
 
-async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
+async def async_setup_entry(hass, entry) -> bool:
     """Set up the WiiM integration from a config entry."""
-    # Create integration-level data storage if it doesn't exist.
-    hass.data.setdefault(DOMAIN, {})
+    from .media_player import WiiMData, async_adopt_unique_id
 
-    # (Optional) Store a shared instance of your global data object.
-    hass.data[DOMAIN]["data"] = WiiMData()
+    # Create integration-level data storage if it doesn't exist.
+    if DOMAIN not in hass.data:
+        hass.data[DOMAIN] = WiiMData(hass)
+        await hass.data[DOMAIN].async_load()
+    # Entries created before discovery have no unique id, discovery would offer them again.
+    async_adopt_unique_id(hass, entry, entry.data.get(CONF_UUID))
+    await hass.data[DOMAIN].async_start_rediscovery()
 
     # Forward the config entry to the supported platforms.
     for platform in PLATFORMS:
@@ -28,76 +25,31 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         )
     return True
 
-async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
+async def async_unload_entry(hass, entry) -> bool:
     """Unload a config entry."""
+    from homeassistant.config_entries import ConfigEntryState
+
     unload_ok = all(
         await hass.config_entries.async_forward_entry_unload(entry, platform)
         for platform in PLATFORMS
     )
-    if unload_ok:
-        hass.data[DOMAIN].pop(entry.entry_id, None)
+    if unload_ok and DOMAIN in hass.data:
+        loaded = [
+            other for other in hass.config_entries.async_entries(DOMAIN)
+            if other.entry_id != entry.entry_id and other.state is ConfigEntryState.LOADED
+        ]
+        if not loaded:
+            await hass.data[DOMAIN].async_shutdown()
     return unload_ok
 
-CMND_SERVICE_SCHEMA = vol.Schema({
-    vol.Required(ATTR_ENTITY_ID): cv.comp_entity_ids,
-    vol.Required(ATTR_CMD): cv.string,
-    vol.Optional(ATTR_NOTIF, default=True): cv.boolean
-})
-
-PLAY_URL_SERVICE_SCHEMA = vol.Schema({
-    vol.Required(ATTR_ENTITY_ID): cv.entity_id,
-    vol.Required(ATTR_URL): cv.string
-})
-
-PRESET_BUTTON_SCHEMA = vol.Schema({
-    vol.Required(ATTR_ENTITY_ID): cv.comp_entity_ids,
-    vol.Required(ATTR_PRESET): cv.positive_int
-})
-
-
-_LOGGER = logging.getLogger(__name__)
-
 async def async_setup(hass, config):
     """Handle service configuration."""
+    from .media_player import WiiMData
+    from .services import async_register_services
 
-    async def async_service_handle(service):
-        """Handle services."""
-        _LOGGER.debug("DOMAIN: %s, entities: %s", DOMAIN, str(hass.data[DOMAIN].entities))
-        _LOGGER.debug("Service_handle from id: %s", service.data.get(ATTR_ENTITY_ID))
-        entity_ids = service.data.get(ATTR_ENTITY_ID)
-        entities = hass.data[DOMAIN].entities
-
-        if entity_ids:
-            if entity_ids == 'all':
-                entity_ids = [e.entity_id for e in entities]
-            entities = [e for e in entities if e.entity_id in entity_ids]
-
-        if service.service == SERVICE_CMD:
-            command = service.data.get(ATTR_CMD)
-            notify = service.data.get(ATTR_NOTIF)
-            for device in entities:
-                if device.entity_id in entity_ids:
-                    _LOGGER.debug("**COMMAND** entity: %s; command: %s", device.entity_id, command)
-                    await device.async_execute_command(command, notify)
-        elif service.service == SERVICE_PLAY_URL:
-            url = service.data.get(ATTR_URL)
-            for device in entities:
-                if device.entity_id in entity_ids:
-                    _LOGGER.debug("**PLAY URL** entity: %s; url: %s", device.entity_id, url)
-                    await device.async_play_media(MediaType.URL, url)
-
-        elif service.service == SERVICE_PRESET:
-            preset = service.data.get(ATTR_PRESET)
-            for device in entities:
-                if device.entity_id in entity_ids:
-                    _LOGGER.debug("**PRESET** entity: %s; preset: %s", device.entity_id, preset)
-                    await device.async_preset_button(preset)
-
-    hass.services.async_register(
-        DOMAIN, SERVICE_CMD, async_service_handle, schema=CMND_SERVICE_SCHEMA)
-    hass.services.async_register(
-        DOMAIN, SERVICE_PLAY_URL, async_service_handle, schema=PLAY_URL_SERVICE_SCHEMA)
-    hass.services.async_register(
-        DOMAIN, SERVICE_PRESET, async_service_handle, schema=PRESET_BUTTON_SCHEMA)
+    if DOMAIN not in hass.data:
+        hass.data[DOMAIN] = WiiMData(hass)
+        await hass.data[DOMAIN].async_load()
 
+    async_register_services(hass)
     return True
@@ -0,0 +1,143 @@
+import asyncio
+import async_timeout
+import logging
+import secrets
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+import aiohttp
+from aiohttp import web
+from http import HTTPStatus
+
+from homeassistant.components.http import HomeAssistantView
+from homeassistant.helpers.network import NoURLAvailableError, get_url
+
+from .const import *
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class AnnouncementStore:
+    """Announcement audio fetched once and served to all players from Home Assistant."""
+
+    def __init__(self, hass, limiter):
+        """Initialize the store."""
+        self._hass = hass
+        self._limiter = limiter
+        self._clips = OrderedDict()
+        self._tokens = {}
+        self._inflight = {}
+        self._view_registered = False
+        self._batches = {}
+        self.last_skew = None
+        self.last_latency = None
+
+    async def async_prefetch(self, session, url):
+        """Download url once, return the local URL the players should fetch it from."""
+        clip = self._clips.get(url)
+        if clip is None or time.monotonic() - clip['fetched'] > ANNOUNCE_CACHE_TTL:
+            task = self._inflight.get(url)
+            if task is None:
+                task = asyncio.ensure_future(self._async_fetch(session, url))
+                self._inflight[url] = task
+                task.add_done_callback(lambda _: self._inflight.pop(url, None))
+            clip = await asyncio.shield(task)
+            if clip is None:
+                return None
+
+        self._register_view()
+        try:
+            base_url = get_url(self._hass, prefer_external=False)
+        except NoURLAvailableError:
+            _LOGGER.warning("No Home Assistant URL available to serve announcements from")
+            return None
+        return "{0}{1}/{2}".format(base_url, ANNOUNCE_URL_PATH, clip['token'])
+
+    def get(self, token):
+        """Return the clip for a token."""
+        url = self._tokens.get(token)
+        return self._clips.get(url) if url is not None else None
+
+    def record_start(self, url):
+        """Note an announcement start; returns the skew against the first player of the batch."""
+        now = time.monotonic()
+        first = self._batches.get(url)
+        if first is None or now - first > ANNOUNCE_BATCH_WINDOW:
+            self._batches = {key: value for key, value in self._batches.items() if now - value <= ANNOUNCE_BATCH_WINDOW}
+            self._batches[url] = first = now
+        self.last_skew = now - first
+        return self.last_skew
+
+    def record_latency(self, latency):
+        """Note the end-to-end time of an announcement."""
+        self.last_latency = latency
+
+    def as_dict(self):
+        """Return the cached clips and the last measured timings for diagnostics."""
+        return {
+            'clips': len(self._clips),
+            'last_skew_ms': round(self.last_skew * 1000, 1) if self.last_skew is not None else None,
+            'last_latency_ms': round(self.last_latency * 1000, 1) if self.last_latency is not None else None,
+        }
+
+    async def _async_fetch(self, session, url):
+        try:
+            async with self._limiter.slot(urlparse(url).hostname):
+                async with async_timeout.timeout(ANNOUNCE_FETCH_TIMEOUT):
+                    async with session.get(url) as response:
+                        if response.status != HTTPStatus.OK:
+                            _LOGGER.warning("Announcement %s get failed, response code: %s", url, response.status)
+                            return None
+                        if (response.content_length or 0) > ANNOUNCE_MAX_BYTES:
+                            _LOGGER.warning("Announcement %s larger than %s bytes, not played", url, ANNOUNCE_MAX_BYTES)
+                            return None
+                        content = bytearray()
+                        async for chunk in response.content.iter_chunked(64 * 1024):
+                            content.extend(chunk)
+                            if len(content) > ANNOUNCE_MAX_BYTES:
+                                _LOGGER.warning("Announcement %s larger than %s bytes, not played", url, ANNOUNCE_MAX_BYTES)
+                                return None
+                        content = bytes(content)
+                        content_type = response.headers.get('Content-Type', 'audio/mpeg').split(';')[0]
+        except (asyncio.TimeoutError, aiohttp.ClientError) as error:
+            _LOGGER.warning("Unable to prefetch announcement %s: %s", url, type(error))
+            return None
+
+        old = self._clips.pop(url, None)
+        if old is not None:
+            self._tokens.pop(old['token'], None)
+        clip = {'content': content,
+                'content_type': content_type,
+                'token': secrets.token_urlsafe(16),
+                'fetched': time.monotonic()}
+        self._clips[url] = clip
+        self._tokens[clip['token']] = url
+        while len(self._clips) > ANNOUNCE_CACHE_SIZE:
+            _, evicted = self._clips.popitem(last=False)
+            self._tokens.pop(evicted['token'], None)
+        return clip
+
+    def _register_view(self):
+        if not self._view_registered:
+            self._hass.http.register_view(AnnouncementView(self))
+            self._view_registered = True
+
+
+class AnnouncementView(HomeAssistantView):
+    """Serve prefetched announcements to the players, which can't authenticate."""
+
+    requires_auth = False
+    url = ANNOUNCE_URL_PATH + "/{token}"
+    name = "api:" + DOMAIN + ":announce"
+
+    def __init__(self, store):
+        """Initialize the view."""
+        self._store = store
+
+    async def get(self, request, token):
+        """Return the clip for an unguessable token."""
+        clip = self._store.get(token)
+        if clip is None:
+            return web.Response(status=HTTPStatus.NOT_FOUND)
+        return web.Response(body=clip['content'], content_type=clip['content_type'])
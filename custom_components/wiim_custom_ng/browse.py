@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import re
+
+from homeassistant.components import media_source
+from homeassistant.components.media_player.browse_media import BrowseMedia
+from homeassistant.components.media_player.const import MediaClass
+from homeassistant.components.media_player.errors import BrowseError
+
+from .cache import TTLCache
+from .const import *
+
+_LOGGER = logging.getLogger(__name__)
+
+PAGE_RE = re.compile(r'^(.*)\|wiim_page=(\d+)$')
+
+
+def audio_filter(item):
+    """Only show audio items."""
+    return item.media_content_type.startswith("audio/")
+
+
+class BrowseCache:
+    """Media browser results shared by all players, with paging of large directories."""
+
+    def __init__(self, hass):
+        """Initialize the cache."""
+        self._hass = hass
+        self._cache = TTLCache(BROWSE_CACHE_TTL, BROWSE_CACHE_SIZE)
+        self._inflight = {}
+        self._generation = 0
+        self._prefetch_limit = asyncio.Semaphore(BROWSE_PREFETCH_CONCURRENCY)
+
+    async def async_browse(self, media_content_id):
+        """Return one page of the audio filtered media source node."""
+        page = 0
+        if media_content_id is not None:
+            match = PAGE_RE.match(media_content_id)
+            if match:
+                media_content_id, page = match.group(1), int(match.group(2))
+
+        node = await self._async_get(media_content_id, prefetch=True)
+        return self._page(node, page)
+
+    async def _async_get(self, media_content_id, prefetch):
+        key = (media_content_id, 'audio')
+        node = self._cache.get(key)
+        if node is not None:
+            return node
+
+        # Several dashboards opening the same folder share one walk of it.
+        generation = self._generation
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(media_source.async_browse_media(
+                self._hass, media_content_id, content_filter=audio_filter
+            ))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        node = await asyncio.shield(task)
+
+        if generation != self._generation:
+            # Cleared while walking, the result may already be outdated.
+            return node
+        self._cache.set(key, node)
+        if prefetch and node.children:
+            self._hass.async_create_task(self._async_prefetch(node))
+        return node
+
+    async def _async_prefetch(self, node):
+        """Warm the cache with the first subfolders, the most likely next clicks."""
+        children = [child for child in node.children if child.can_expand][:BROWSE_PREFETCH_CHILDREN]
+        for child in children:
+            async with self._prefetch_limit:
+                try:
+                    await self._async_get(child.media_content_id, prefetch=False)
+                except BrowseError as error:
+                    _LOGGER.debug("Prefetch of %s failed: %s", child.media_content_id, error)
+
+    def clear(self):
+        """Forget everything, e.g. when the media library changed."""
+        self._generation += 1
+        self._cache.clear()
+        self._inflight.clear()
+
+    def _page(self, node, page):
+        if node.children is None or len(node.children) <= BROWSE_PAGE_SIZE:
+            return node
+
+        start = page * BROWSE_PAGE_SIZE
+        children = list(node.children[start:start + BROWSE_PAGE_SIZE])
+        if start + BROWSE_PAGE_SIZE < len(node.children):
+            children.append(BrowseMedia(
+                media_class=MediaClass.DIRECTORY,
+                media_content_id="{0}|wiim_page={1}".format(node.media_content_id, page + 1),
+                media_content_type=node.media_content_type,
+                title="More ({0}-{1} of {2})".format(
+                    start + BROWSE_PAGE_SIZE + 1,
+                    min(start + 2 * BROWSE_PAGE_SIZE, len(node.children)),
+                    len(node.children),
+                ),
+                can_play=False,
+                can_expand=True,
+            ))
+
+        return BrowseMedia(
+            media_class=node.media_class,
+            media_content_id=node.media_content_id,
+            media_content_type=node.media_content_type,
+            title=node.title if page == 0 else "{0} ({1})".format(node.title, page + 1),
+            can_play=node.can_play,
+            can_expand=node.can_expand,
+            children=children,
+            children_media_class=node.children_media_class,
+            thumbnail=node.thumbnail,
+            not_shown=node.not_shown,
+        )
@@ -0,0 +1,137 @@
+import asyncio
+import async_timeout
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+import aiohttp
+from http import HTTPStatus
+
+from .const import *
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ArtCache:
+    """Album art cache shared by all players, bounded by the total size of the images."""
+
+    def __init__(self, limiter, max_bytes=ART_CACHE_MAX_BYTES, max_age=ART_CACHE_MAX_AGE):
+        """Initialize the cache."""
+        self._limiter = limiter
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.size = 0
+
+    @staticmethod
+    def key(url):
+        """Return the cache key for an image URL."""
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    async def async_get(self, session, url):
+        """Return (content, content_type) for url, fetching or revalidating it when needed."""
+        key = self.key(url)
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry['checked'] < self._max_age:
+            self._entries.move_to_end(key)
+            return entry['content'], entry['content_type']
+
+        # Players showing the same track share a single request.
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._async_fetch(session, url, key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _async_fetch(self, session, url, key):
+        entry = self._entries.get(key)
+        headers = {}
+        if entry is not None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        try:
+            async with self._limiter.slot(urlparse(url).hostname):
+                async with async_timeout.timeout(ART_FETCH_TIMEOUT):
+                    async with session.get(url, headers=headers) as response:
+                        if response.status == HTTPStatus.NOT_MODIFIED and entry is not None:
+                            entry['checked'] = time.monotonic()
+                            self._entries.move_to_end(key)
+                            return entry['content'], entry['content_type']
+                        if response.status != HTTPStatus.OK:
+                            _LOGGER.debug("Album art %s, response code: %s", url, response.status)
+                            return None, None
+                        content = await response.read()
+        except (asyncio.TimeoutError, aiohttp.ClientError) as error:
+            _LOGGER.debug("Failed fetching album art %s: %s", url, type(error))
+            if entry is not None:
+                return entry['content'], entry['content_type']
+            return None, None
+
+        content_type = response.headers.get('Content-Type', '').split(';')[0] or None
+        self._store(key, {
+            'content': content,
+            'content_type': content_type,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'checked': time.monotonic(),
+        })
+        return content, content_type
+
+    def _store(self, key, entry):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old['content'])
+        if len(entry['content']) > self._max_bytes:
+            return
+        self._entries[key] = entry
+        self.size += len(entry['content'])
+        while self.size > self._max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted['content'])
+
+
+class TTLCache:
+    """Small LRU cache whose entries expire a fixed time after they were stored."""
+
+    def __init__(self, ttl, maxsize):
+        """Initialize the cache."""
+        self._ttl = ttl
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """Return the cached value or None when missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored, value = entry
+        if time.monotonic() - stored > self._ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used entries."""
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic(), value)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key):
+        """Drop a single entry."""
+        self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop all entries."""
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
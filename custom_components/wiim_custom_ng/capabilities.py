@@ -0,0 +1,57 @@
+from .const import *
+
+PLM_LINE_IN = 0x2
+PLM_OPTICAL = 0x10
+
+UNSUPPORTED_RESPONSES = ['unknown command']
+
+
+def capability_key(device_status):
+    """Return the (model, firmware) key the capabilities are shared by, None if unknown."""
+    project = device_status.get('project')
+    firmware = device_status.get('firmware')
+    if not project or not firmware:
+        return None
+    return "{0}|{1}".format(project, firmware)
+
+
+def probe_capabilities(device_status):
+    """Derive the capabilities of a model/firmware from its getStatusEx response."""
+    model = MODEL_MAP.get(device_status.get('project'), 'Unknown')
+    try:
+        plm_support = int(str(device_status['plm_support']), 16)
+    except (KeyError, ValueError):
+        plm_support = None
+
+    if plm_support is not None:
+        sources = []
+        if plm_support & PLM_LINE_IN:
+            sources.append('line-in')
+        if plm_support & PLM_OPTICAL:
+            sources.append('optical')
+    else:
+        sources = [source for source in SOURCES if not (source == 'optical' and model == 'WiiM Mini')]
+        sources = [source for source in sources if source != 'HDMI']
+    # plm_support has no HDMI bit.
+    if model == 'WiiM Amp':
+        sources.append('HDMI')
+
+    try:
+        presets = int(device_status['preset_key'])
+    except (KeyError, ValueError):
+        presets = 6
+
+    return {
+        'sources': sources,
+        'presets': presets,
+        'plm_support': plm_support is not None,
+        'unsupported': [],
+    }
+
+
+def command_key(cmd):
+    """Return the part of a HTTP API command identifying it, without its value."""
+    parts = cmd.split(':')
+    if len(parts) > 2 and parts[1] == 'switchmode':
+        return ':'.join(parts[:3])
+    return ':'.join(parts[:2])
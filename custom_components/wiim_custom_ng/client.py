@@ -0,0 +1,285 @@
+import asyncio
+import async_timeout
+import logging
+import time
+from xml.sax.saxutils import escape as xml_escape
+
+import aiohttp
+from http import HTTPStatus
+
+from .capabilities import command_key
+from .const import *
+from .limiter import TrafficLimiter
+from .planner import plan_size
+from .rtt import RttEstimator
+from .upnp import UpnpPool
+
+_LOGGER = logging.getLogger(__name__)
+
+# Nothing in here may import Home Assistant, so the protocol can be used, timed and
+# profiled on its own, e.g. by the fleet tooling.
+
+REPEAT_OFF = 'off'
+REPEAT_ALL = 'all'
+REPEAT_ONE = 'one'
+
+LOOP_MODE_SHUFFLE = {2: True, 3: True, 5: True}
+LOOP_MODE_REPEAT = {0: REPEAT_ALL, 1: REPEAT_ONE, 2: REPEAT_ALL, 5: REPEAT_ONE}
+LOOP_MODES = {
+    (True, REPEAT_OFF): '3',
+    (True, REPEAT_ALL): '2',
+    (True, REPEAT_ONE): '3', #'5' is buggy
+    (False, REPEAT_OFF): '4',
+    (False, REPEAT_ALL): '0',
+    (False, REPEAT_ONE): '1',
+}
+
+
+def hms_to_seconds(value):
+    """Convert H:MM:SS to seconds."""
+    return int(sum([int(x) * int(y) for x, y in zip([3600, 60, 1], value.split(":"))]))
+
+
+def msec_to_hms(msec):
+    """Convert milliseconds to H:MM:SS."""
+    seconds = int(msec or 0) // 1000
+    return "{0}:{1:02d}:{2:02d}".format(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+def loop_mode_to_shuffle_repeat(loop_mode):
+    """Return (shuffle, repeat) for a LoopMode value."""
+    return LOOP_MODE_SHUFFLE.get(loop_mode, False), LOOP_MODE_REPEAT.get(loop_mode, REPEAT_OFF)
+
+
+def shuffle_repeat_to_loop_mode(shuffle, repeat):
+    """Return the loopmode value setting shuffle and repeat."""
+    return LOOP_MODES.get((bool(shuffle), repeat), '4')
+
+
+def decode_hex(value):
+    """Decode the hex encoded strings of getPlayerStatus."""
+    try:
+        return bytes.fromhex(value).decode('utf-8', errors='replace')
+    except (TypeError, ValueError):
+        return value
+
+
+def normalize_player_status(data, prev=None):
+    """Turn a getPlayerStatus response into the (transport, rendering, media) info of UPnP.
+
+    prev is the previous transport info, it provides what getPlayerStatus doesn't report.
+    Raises ValueError on an unexpected response.
+    """
+    prev = prev if isinstance(prev, dict) else {}
+    metadata = None
+    if data.get('Title') or data.get('Artist') or data.get('Album'):
+        metadata = (
+            '<DIDL-Lite xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/" '
+            'xmlns:dc="http://purl.org/dc/elements/1.1/" '
+            'xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/"><item>'
+            '<dc:title>{0}</dc:title><upnp:artist>{1}</upnp:artist><upnp:album>{2}</upnp:album>'
+            '</item></DIDL-Lite>'
+        ).format(
+            xml_escape(decode_hex(data.get('Title', ''))),
+            xml_escape(decode_hex(data.get('Artist', ''))),
+            xml_escape(decode_hex(data.get('Album', ''))),
+        )
+
+    try:
+        statdata = {
+            'CurrentTransportState': HTTPAPI_TRANSPORT_STATES.get(data.get('status'), 'STOPPED'),
+            'PlayType': str(data.get('mode', '0')),
+            'LoopMode': int(data.get('loop', 4)),
+            'CurrentVolume': int(data.get('vol', 0)),
+            'TrackDuration': msec_to_hms(data.get('totlen')),
+            'RelTime': msec_to_hms(data.get('curpos')),
+            'Track': int(data.get('plicurr', 0)),
+            'SlaveFlag': prev.get('SlaveFlag', 0),
+            'MasterUUID': prev.get('MasterUUID', ''),
+            'TrackURI': prev.get('TrackURI') if metadata == prev.get('TrackMetaData') else None,
+            'TrackSource': prev.get('TrackSource'),
+            'TrackMetaData': metadata,
+        }
+        deviceinfo = {'CurrentMute': int(data.get('mute', 0))}
+        mediainfo = {'NrTracks': int(data.get('plicount', 0))}
+    except TypeError as error:
+        raise ValueError(error) from error
+
+    return statdata, deviceinfo, mediainfo
+
+
+class WiiMState:
+    """Player state decoded from the transport, rendering and media info."""
+
+    def __init__(self, statdata, deviceinfo, mediainfo):
+        """Decode the status dicts, they are kept as received."""
+        self.statdata = statdata
+        self.deviceinfo = deviceinfo
+        self.mediainfo = mediainfo
+        self.transport_state = statdata['CurrentTransportState']
+        self.play_type = statdata['PlayType']
+        self.volume = statdata['CurrentVolume']
+        self.muted = bool(deviceinfo['CurrentMute'])
+        self.shuffle, self.repeat = loop_mode_to_shuffle_repeat(statdata['LoopMode'])
+        self.duration = hms_to_seconds(statdata['TrackDuration'])
+        self.position = hms_to_seconds(statdata['RelTime'])
+        self.track = statdata['Track']
+        self.tracks = mediainfo['NrTracks']
+        self.slave = statdata['SlaveFlag']
+        self.master_uuid = statdata['MasterUUID']
+        self.metadata = statdata.get('TrackMetaData')
+
+
+class WiiMClient:
+    """Talk to one WiiM/LinkPlay player over its HTTP API and UPnP."""
+
+    def __init__(self, session, host, limiter=None, upnp=None, name=None, base_url=None, description_url=None):
+        """Initialize the client, limiter and UPnP pool can be shared between clients.
+
+        base_url and description_url replace the HTTP API and UPnP addresses derived
+        from host, e.g. for a simulated player.
+        """
+        self.host = host
+        self.base_url = base_url
+        self.description_url = description_url
+        self.name = name or host
+        self.rtt = {}
+        self._session = session
+        self._limiter = limiter or TrafficLimiter()
+        self._upnp = upnp or UpnpPool()
+
+    def rtt_estimator(self, endpoint):
+        """Return the round-trip time estimator of an endpoint of the device."""
+        rtt = self.rtt.get(endpoint)
+        if rtt is None:
+            if endpoint.startswith('upnp:'):
+                rtt = RttEstimator(UPNP_TIMEOUT, UPNP_TIMEOUT_MIN, UPNP_TIMEOUT_MAX)
+            elif not endpoint.startswith('get'):
+                # Commands changing state may take the player a while to carry out, a timeout
+                # reports them as failed although they still happen.
+                rtt = RttEstimator(API_TIMEOUT, API_TIMEOUT, API_TIMEOUT_MAX)
+            else:
+                rtt = RttEstimator(API_TIMEOUT, API_TIMEOUT_MIN, API_TIMEOUT_MAX)
+            self.rtt[endpoint] = rtt
+        return rtt
+
+    def httpapi_url(self, cmd):
+        """Return the HTTP API URL of a command."""
+        return "{0}/httpapi.asp?command={1}".format(self.base_url or "https://" + self.host, cmd)
+
+    async def async_httpapi(self, cmd, jsn, timeout=None):
+        """Send a HTTP API command, return the decoded response or False on failure."""
+        _LOGGER.debug("For: %s  cmd: %s  jsn: %s", self.name, cmd, jsn)
+        url = self.httpapi_url(cmd)
+
+        rtt = self.rtt_estimator(command_key(cmd))
+        if timeout is None:
+            timeout = rtt.timeout()
+
+        try:
+            async with self._limiter.slot(self.host):
+                started = time.monotonic()
+                async with async_timeout.timeout(timeout):
+                    async with self._session.get(url, ssl=False) as response:
+                        if response.status != HTTPStatus.OK:
+                            _LOGGER.error(
+                                "For: %s (%s) Get failed, response code: %s Full message: %s",
+                                self.name,
+                                self.host,
+                                response.status,
+                                response,
+                            )
+                            return False
+                        if jsn:
+                            data = await response.json(content_type=None)
+                        else:
+                            data = await response.text()
+                rtt.add_sample(time.monotonic() - started)
+
+        except (asyncio.TimeoutError, aiohttp.ClientError, ValueError) as error:
+            # ValueError covers a body that isn't the expected JSON.
+            if isinstance(error, asyncio.TimeoutError):
+                rtt.add_timeout()
+            _LOGGER.warning(
+                "Failed communicating with WiiM (httpapi) '%s': %s", self.name, type(error)
+            )
+            return False
+
+        if not jsn:
+            _LOGGER.debug("For: %s  cmd: %s  resp: %s", self.name, cmd, data)
+        return data
+
+    async def async_run_plan(self, plan):
+        """Send the commands of a plan, stage after stage, return the responses by command."""
+        _LOGGER.debug("For: %s  plan: %s (%s commands)", self.name, plan, plan_size(plan))
+        values = {}
+        for stage in plan:
+            results = await asyncio.gather(*[self.async_httpapi(cmd, None) for cmd in stage])
+            values.update(zip(stage, results))
+        return values
+
+    async def async_player_status(self, prev=None):
+        """Fetch getPlayerStatus normalized to the UPnP status model, None on failure."""
+        data = await self.async_httpapi("getPlayerStatus", True)
+        if not isinstance(data, dict):
+            return None
+        try:
+            return normalize_player_status(data, prev)
+        except ValueError:
+            _LOGGER.warning("Unexpected getPlayerStatus response for: %s, %s", self.name, data)
+            return None
+
+    async def async_reachable(self, timeout=LIVENESS_TIMEOUT):
+        """Return True as soon as the UPnP or HTTP API port of the player accepts a connection."""
+        async def connect(port):
+            try:
+                async with async_timeout.timeout(timeout):
+                    _, writer = await asyncio.open_connection(self.host, port)
+            except (OSError, asyncio.TimeoutError):
+                return False
+            writer.close()
+            return True
+
+        tasks = [asyncio.ensure_future(connect(port)) for port in LIVENESS_PORTS]
+        try:
+            for task in asyncio.as_completed(tasks):
+                if await task:
+                    return True
+            return False
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def async_create_upnp_device(self):
+        """Fetch the UPnP description of the player, return the device or None."""
+        url = self.description_url or "http://{0}:49152/description.xml".format(self.host)
+        rtt = self.rtt_estimator('upnp:description')
+        try:
+            async with self._limiter.slot(self.host):
+                started = time.monotonic()
+                async with async_timeout.timeout(rtt.timeout()):
+                    device = await self._upnp.factory.async_create_device(url)
+                rtt.add_sample(time.monotonic() - started)
+                return device
+        except asyncio.TimeoutError:
+            rtt.add_timeout()
+        except Exception:
+            pass
+        _LOGGER.warning(
+            "Failed communicating with WiiM (UPnP) '%s' at %s", self.name, self.host
+        )
+        return None
+
+    async def async_upnp_action(self, service, action):
+        """Call a UPnP action of the player within the traffic limits."""
+        rtt = self.rtt_estimator('upnp:' + action)
+        async with self._limiter.slot(self.host):
+            started = time.monotonic()
+            try:
+                async with async_timeout.timeout(rtt.timeout()):
+                    result = await service.action(action).async_call(InstanceID=0)
+            except asyncio.TimeoutError:
+                rtt.add_timeout()
+                raise
+            rtt.add_sample(time.monotonic() - started)
+            return result
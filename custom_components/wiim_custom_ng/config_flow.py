@@ -1,9 +1,16 @@
+import re
+from urllib.parse import urlparse
+
 from homeassistant import config_entries
+from homeassistant.components import ssdp, zeroconf
 from homeassistant.helpers import selector
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
 import voluptuous as vol
 
 from . import DOMAIN
 from .const import *
+from .discovery import async_probe_host, async_probe_hosts, normalize_uuid
+from .media_player import WiiMData
 
 CONFIG_FLOW_SCHEMA = vol.Schema({
     vol.Required(CONF_HOST): selector.TextSelector(),
@@ -12,14 +19,141 @@ CONFIG_FLOW_SCHEMA = vol.Schema({
     vol.Optional(CONF_VOLUME_STEP, default=5): vol.All(int, vol.Range(min=1, max=25)),
 })
 
+BULK_FLOW_SCHEMA = vol.Schema({
+    vol.Optional(CONF_HOSTS, default=""): selector.TextSelector(selector.TextSelectorConfig(multiline=True)),
+    vol.Optional(CONF_VOLUME_STEP, default=5): vol.All(int, vol.Range(min=1, max=25)),
+})
+
 class MyIntegrationConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     VERSION = 1
 
+    def __init__(self):
+        """Initialize the flow."""
+        self._discovered = None
+
+    async def _async_data(self):
+        if DOMAIN not in self.hass.data:
+            self.hass.data[DOMAIN] = WiiMData(self.hass)
+            await self.hass.data[DOMAIN].async_load()
+        return self.hass.data[DOMAIN]
+
+    async def _async_probe(self, host):
+        data = await self._async_data()
+        player = await async_probe_host(async_get_clientsession(self.hass), data.limiter, host)
+        if player is not None:
+            # The probe already paid for getStatusEx, so the first poll doesn't have to.
+            data.save_profile(player['status'])
+        return player
+
+    def _configured_uuids(self):
+        # Entries that have not been set up since discovery was added only carry the uuid in their data.
+        uuids = set(self._async_current_ids())
+        for entry in self._async_current_entries():
+            uuids.add(normalize_uuid(entry.data.get(CONF_UUID)))
+        return uuids
+
+    def _entry_data(self, player, volume_step=DEFAULT_VOLUME_STEP):
+        return {
+            CONF_HOST: player['host'],
+            CONF_NAME: player['name'],
+            CONF_UUID: player['uuid'],
+            CONF_VOLUME_STEP: volume_step,
+        }
+
     async def async_step_user(self, user_input=None):
+        return self.async_show_menu(step_id="user", menu_options=["manual", "bulk"])
+
+    async def async_step_manual(self, user_input=None):
         errors = {}
         if user_input is not None:
-            return self.async_create_entry(title="WiiM Streamer", data=user_input)
+            player = await self._async_probe(user_input[CONF_HOST])
+            if player is None:
+                errors["base"] = "cannot_connect"
+            else:
+                await self.async_set_unique_id(normalize_uuid(player['uuid']))
+                self._abort_if_unique_id_configured(updates={CONF_HOST: player['host']})
+                user_input[CONF_UUID] = player['uuid']
+                return self.async_create_entry(title=user_input[CONF_NAME], data=user_input)
+
+        return self.async_show_form(
+            step_id="manual", data_schema=CONFIG_FLOW_SCHEMA, errors=errors
+        )
+
+    async def async_step_bulk(self, user_input=None):
+        """Probe the given hosts and every renderer seen via SSDP, add all new players at once."""
+        if user_input is None:
+            return self.async_show_form(step_id="bulk", data_schema=BULK_FLOW_SCHEMA)
+
+        hosts = {host for host in re.split(r'[\s,;]+', user_input.get(CONF_HOSTS, '')) if host}
+        if "ssdp" in self.hass.config.components:
+            for discovery_info in await ssdp.async_get_discovery_info_by_st(self.hass, DISCOVERY_ST):
+                host = urlparse(discovery_info.ssdp_location or '').hostname
+                if host:
+                    hosts.add(host)
+
+        data = await self._async_data()
+        players = await async_probe_hosts(async_get_clientsession(self.hass), data.limiter, hosts)
+        configured = self._configured_uuids()
+        players = [player for player in players if normalize_uuid(player['uuid']) not in configured]
+        if not players:
+            return self.async_abort(reason="no_devices_found")
+
+        for player in players:
+            data.save_profile(player['status'])
+        for player in players[1:]:
+            self.hass.async_create_task(
+                self.hass.config_entries.flow.async_init(
+                    DOMAIN,
+                    context={"source": config_entries.SOURCE_IMPORT},
+                    data=self._entry_data(player, user_input[CONF_VOLUME_STEP]),
+                )
+            )
+
+        player = players[0]
+        await self.async_set_unique_id(normalize_uuid(player['uuid']))
+        self._abort_if_unique_id_configured(updates={CONF_HOST: player['host']})
+        return self.async_create_entry(title=player['name'], data=self._entry_data(player, user_input[CONF_VOLUME_STEP]))
+
+    async def async_step_import(self, import_data):
+        """Create an entry for a player already probed by the bulk step."""
+        await self.async_set_unique_id(normalize_uuid(import_data[CONF_UUID]))
+        self._abort_if_unique_id_configured(updates={CONF_HOST: import_data[CONF_HOST]})
+        return self.async_create_entry(title=import_data[CONF_NAME], data=import_data)
+
+    async def async_step_ssdp(self, discovery_info: ssdp.SsdpServiceInfo):
+        host = urlparse(discovery_info.ssdp_location or '').hostname
+        udn = discovery_info.upnp.get(ssdp.ATTR_UPNP_UDN) or discovery_info.ssdp_udn
+        return await self._async_step_discovered(host, normalize_uuid(udn))
+
+    async def async_step_zeroconf(self, discovery_info: zeroconf.ZeroconfServiceInfo):
+        return await self._async_step_discovered(discovery_info.host, None)
+
+    async def _async_step_discovered(self, host, unique_id):
+        if not host:
+            return self.async_abort(reason="cannot_connect")
+        if unique_id is not None:
+            # Known players only get their address refreshed, without probing them again.
+            await self.async_set_unique_id(unique_id)
+            self._abort_if_unique_id_configured(updates={CONF_HOST: host})
+            if unique_id in self._configured_uuids():
+                return self.async_abort(reason="already_configured")
+
+        player = await self._async_probe(host)
+        if player is None:
+            return self.async_abort(reason="cannot_connect")
+        await self.async_set_unique_id(normalize_uuid(player['uuid']))
+        self._abort_if_unique_id_configured(updates={CONF_HOST: host})
+        if self.unique_id in self._configured_uuids():
+            return self.async_abort(reason="already_configured")
+
+        self._discovered = player
+        self.context["title_placeholders"] = {"name": player['name']}
+        return await self.async_step_discovery_confirm()
+
+    async def async_step_discovery_confirm(self, user_input=None):
+        if user_input is not None:
+            return self.async_create_entry(title=self._discovered['name'], data=self._entry_data(self._discovered))
 
         return self.async_show_form(
-            step_id="user", data_schema=CONFIG_FLOW_SCHEMA, errors=errors
+            step_id="discovery_confirm", description_placeholders={"name": self._discovered['name']}
         )
@@ -29,12 +29,16 @@ ATTR_CMD = 'command'
 ATTR_NOTIF = 'notify'
 ATTR_URL = 'url'
 ATTR_PRESET = 'preset'
+ATTR_VOLUME = 'volume_level'
+ATTR_DURATION = 'duration'
+ATTR_CURVE = 'curve'
 
 
 CONF_NAME = 'name'
 CONF_HOST = 'host'
 CONF_VOLUME_STEP = 'volume_step'
 CONF_UUID = 'uuid'
+CONF_HOSTS = 'hosts'
 
 DEFAULT_VOLUME_STEP = 5
 
@@ -43,11 +47,90 @@ DEBUGSTR_ATTR = True
 MAX_VOL = 100
 
 UPNP_TIMEOUT = 2
+UPNP_TIMEOUT_MIN = 0.5
+UPNP_TIMEOUT_MAX = 10
+UPNP_POOL_LIMIT = 64
+UPNP_POOL_LIMIT_PER_HOST = 2
 API_TIMEOUT = 2
+API_TIMEOUT_MIN = 0.5
+API_TIMEOUT_MAX = 10
+MAX_REDIRECTS = 5
+
+ART_FETCH_TIMEOUT = 10
+ART_CACHE_MAX_AGE = 600
+ART_CACHE_MAX_BYTES = 8 * 1024 * 1024
+
+PLAYLIST_TIMEOUT = 10
+PLAYLIST_MAX_BYTES = 64 * 1024
+PLAYLIST_CACHE_TTL = 300
+PLAYLIST_CACHE_SIZE = 64
+PLAYLIST_EXTENSIONS = ('.m3u', '.m3u8', '.pls')
+
+BROWSE_CACHE_TTL = 300
+BROWSE_CACHE_SIZE = 256
+BROWSE_PAGE_SIZE = 200
+BROWSE_PREFETCH_CHILDREN = 5
+BROWSE_PREFETCH_CONCURRENCY = 2
+
+FADE_MIN_WRITE_INTERVAL = 0.25
+
+ANNOUNCE_URL_PATH = '/api/' + DOMAIN + '/announce'
+ANNOUNCE_FETCH_TIMEOUT = 10
+ANNOUNCE_CACHE_TTL = 300
+ANNOUNCE_CACHE_SIZE = 16
+ANNOUNCE_MAX_BYTES = 10 * 1024 * 1024
+ANNOUNCE_BATCH_WINDOW = 5
+ANNOUNCE_POLL_INTERVAL = 0.5
+ANNOUNCE_START_TIMEOUT = 5
+ANNOUNCE_MAX_DURATION = 120
+
+WATCHDOG_THRESHOLD = 0.1
+WATCHDOG_SAMPLES = 20
+WATCHDOG_STACK_DEPTH = 12
+
+XML_INLINE_MAX_BYTES = 8 * 1024
+XML_PARSE_CONCURRENCY = 4
+
+LIMIT_HOST_RATE = 10
+LIMIT_HOST_BURST = 5
+LIMIT_MAX_INFLIGHT = 32
+LIMIT_MAX_HOSTS = 256
+
+DISCOVERY_ST = 'urn:schemas-upnp-org:device:MediaRenderer:1'
+DISCOVERY_PROBE_TIMEOUT = 3
+
+GROUP_CONFIRM_TIMEOUT = 10
+GROUP_CONFIRM_INTERVAL = 1
+
+UPDATE_FRESH_WINDOW = 1.0
+
+RTT_ALPHA = 0.125
+RTT_BETA = 0.25
+RTT_K = 4
+RTT_GRANULARITY = 0.1
+
+HEDGE_SAMPLES = 50
+HEDGE_MIN_SAMPLES = 10
+HEDGE_MIN_DELAY = 0.25
+HEDGE_MAX_DELAY = 1.0
+
+LIVENESS_PORTS = (49152, 443)
+LIVENESS_TIMEOUT = 0.5
 
 UNA_THROTTLE = timedelta(seconds=20)
+HOST_RETRY_MAX = timedelta(minutes=5)
+PROFILE_MAX_AGE = timedelta(hours=24)
+SLOW_LANE_INTERVAL = timedelta(seconds=60)
+DEVICE_INFO_INTERVAL = timedelta(hours=6)
 CONNECT_PAUSED_TIMEOUT = timedelta(seconds=300)
 AUTOIDLE_STATE_TIMEOUT = timedelta(seconds=1)
+QUEUE_END_CHECK_WINDOW = timedelta(seconds=15)
+
+STORAGE_KEY = DOMAIN
+STORAGE_VERSION = 1
+STORAGE_SAVE_DELAY = 10
+
+PROFILE_KEYS = ['uuid', 'DeviceName', 'firmware', 'project', 'volume_control', 'preset_key', 'plm_support']
 
 MODEL_MAP = {'Muzo_Mini': 'WiiM Mini',
              'WiiM_Pro_with_gc4a': 'WiiM Pro',
@@ -77,6 +160,12 @@ SOURCES_MAP = {'-1': 'Idle',
                '49': 'HDMI',			   
                '99': 'Idle'}
 
+HTTPAPI_TRANSPORT_STATES = {'play': 'PLAYING',
+                            'pause': 'PAUSED_PLAYBACK',
+                            'stop': 'STOPPED',
+                            'load': 'TRANSITIONING',
+                            'none': 'NO_MEDIA_PRESENT'}
+
 SOURCES_IDLE = ['-1', '0', '99']
 SOURCES_LIVEIN = ['40', '41', '43', '49']
 SOURCES_STREAM = ['1', '2', '3', '4', '5', '10', '20', '33', '34']
@@ -85,3 +174,7 @@ SOURCES_CONNECT = ['31', '32']
 SERVICE_CMD = 'command'
 SERVICE_PLAY_URL = 'play_url'
 SERVICE_PRESET = 'preset'
+SERVICE_FADE_VOLUME = 'fade_volume'
+SERVICE_GROUP_VOLUME = 'group_volume'
+
+EVENT_TRACK_CHANGED = DOMAIN + '_track_changed'
@@ -0,0 +1,22 @@
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .const import *
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry) -> dict:
+    """Return diagnostics for a config entry."""
+    data = hass.data[DOMAIN]
+    devices = [
+        device.diagnostics()
+        for device in data.entities
+        if device.registry_entry is not None and device.registry_entry.config_entry_id == entry.entry_id
+    ]
+    return {
+        'devices': devices,
+        'watchdog': data.watchdog.as_dict(),
+        'limiter': data.limiter.as_dict(),
+        'upnp': data.upnp.as_dict(),
+        'announcements': data.announcements.as_dict(),
+        'metadata_parser': {'inline': data.metadata_parser.inline, 'offloaded': data.metadata_parser.offloaded},
+    }
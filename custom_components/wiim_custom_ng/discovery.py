@@ -0,0 +1,105 @@
+import asyncio
+import async_timeout
+import json
+import logging
+import re
+
+from http import HTTPStatus
+from lxml import etree as ET
+
+from .const import *
+
+_LOGGER = logging.getLogger(__name__)
+
+DEVICE_XML_PATH = "{urn:schemas-upnp-org:device-1-0}device/"
+
+
+def normalize_uuid(uuid):
+    """Return the comparable form of a getStatusEx uuid or an UPnP UDN.
+
+    LinkPlay UDNs are the 24 hex digit getStatusEx uuid with dashes and the
+    first 8 digits repeated at the end, so only the first 24 digits are kept.
+    """
+    if not uuid:
+        return None
+    uuid = re.sub(r'[^0-9A-F]', '', uuid.upper().replace('UUID:', ''))
+    return uuid[:24] or None
+
+
+def parse_description(description):
+    """Return the interesting fields of an UPnP device description."""
+    try:
+        xml_tree = ET.fromstring(description, ET.XMLParser(recover=True))
+    except ET.XMLSyntaxError:
+        return None
+    if xml_tree is None:
+        return None
+
+    def text(tag):
+        node = xml_tree.find("{0}{{urn:schemas-upnp-org:device-1-0}}{1}".format(DEVICE_XML_PATH, tag))
+        return node.text if node is not None else None
+
+    return {
+        'udn': text('UDN'),
+        'friendly_name': text('friendlyName'),
+        'manufacturer': text('manufacturer'),
+        'model_name': text('modelName'),
+        'model_number': text('modelNumber'),
+        'software_version': text('softwareVersion') or text('firmwareVersion'),
+    }
+
+
+async def _async_get(session, limiter, host, url, ssl):
+    async with limiter.slot(host):
+        async with session.get(url, ssl=ssl) as response:
+            if response.status != HTTPStatus.OK:
+                return None
+            return await response.read()
+
+
+async def async_probe_host(session, limiter, host, timeout=DISCOVERY_PROBE_TIMEOUT):
+    """Fetch description.xml and getStatusEx of host at the same time.
+
+    Returns a dict with host, uuid, name and the getStatusEx response, or None
+    if host doesn't answer like a WiiM/LinkPlay player before the deadline.
+    """
+    description_url = "http://{0}:49152/description.xml".format(host)
+    status_url = "https://{0}/httpapi.asp?command=getStatusEx".format(host)
+    try:
+        async with async_timeout.timeout(timeout):
+            description, status = await asyncio.gather(
+                _async_get(session, limiter, host, description_url, None),
+                _async_get(session, limiter, host, status_url, False),
+                return_exceptions=True)
+    except asyncio.TimeoutError:
+        _LOGGER.debug("Probe of %s timed out", host)
+        return None
+
+    device_status = None
+    if isinstance(status, bytes):
+        try:
+            device_status = json.loads(status)
+        except ValueError:
+            device_status = None
+    if not isinstance(device_status, dict) or 'uuid' not in device_status:
+        _LOGGER.debug("Probe of %s: no getStatusEx response (%s)", host, status)
+        return None
+
+    device = parse_description(description) if isinstance(description, bytes) else None
+    return {
+        'host': host,
+        'uuid': device_status['uuid'],
+        'name': device_status.get('DeviceName') or (device or {}).get('friendly_name') or host,
+        'udn': (device or {}).get('udn'),
+        'status': device_status,
+    }
+
+
+async def async_probe_hosts(session, limiter, hosts, timeout=DISCOVERY_PROBE_TIMEOUT):
+    """Probe all hosts concurrently, return the players found, one per uuid."""
+    results = await asyncio.gather(*[async_probe_host(session, limiter, host, timeout) for host in set(hosts)])
+    players = {}
+    for result in results:
+        if result is not None:
+            players.setdefault(normalize_uuid(result['uuid']), result)
+    return list(players.values())
@@ -0,0 +1,113 @@
+import asyncio
+import functools
+import logging
+import time
+
+from .const import *
+
+_LOGGER = logging.getLogger(__name__)
+
+FADE_CURVES = {
+    'linear': lambda x: x,
+    'ease_in': lambda x: x * x,
+    'ease_out': lambda x: 1 - (1 - x) * (1 - x),
+}
+
+
+class VolumeFader:
+    """Run volume fades of all players from one ticker, at a bounded write rate per player."""
+
+    def __init__(self):
+        """Initialize the fader."""
+        self._fades = {}
+        self._ticker = None
+
+    def start(self, player, start, target, duration, curve='linear'):
+        """Fade player from start to target volume (0..100) over duration seconds.
+
+        player has to provide async_write_volume(volume) returning True on success.
+        A running fade of the same player is replaced.
+        """
+        # The dict is the identity of the fade, writes of a replaced fade are dropped.
+        previous = self._fades.get(player)
+        self._fades[player] = {
+            'start': int(start),
+            'target': int(target),
+            'duration': max(float(duration), 0),
+            'curve': FADE_CURVES.get(curve, FADE_CURVES['linear']),
+            'started': time.monotonic(),
+            'written': int(start),
+            'written_at': 0,
+            'done': False,
+            # A write of the replaced fade still on its way is waited for, so the writes stay in order.
+            'inflight': previous['inflight'] if previous is not None else None,
+        }
+        if self._ticker is None or self._ticker.done():
+            self._ticker = asyncio.ensure_future(self._async_run())
+
+    async def async_cancel(self, player):
+        """Stop the fade of player, if any, at its current level.
+
+        Returns once a write of the fade already sent to the player has finished, so a
+        volume written afterwards isn't overwritten by it.
+        """
+        fade = self._fades.pop(player, None)
+        if fade is None:
+            return
+        _LOGGER.debug("Volume fade cancelled for %s", player.name)
+        if fade['inflight'] is not None and not fade['inflight'].done():
+            await asyncio.wait([fade['inflight']])
+
+    def is_fading(self, player):
+        """Return True while player has a fade in progress."""
+        return player in self._fades
+
+    async def _async_write(self, player, fade, level):
+        if self._fades.get(player) is not fade:
+            return True
+        return await player.async_write_volume(level)
+
+    def _write_done(self, player, fade, task):
+        current = self._fades.get(player)
+        if current is not None and current['inflight'] is task:
+            current['inflight'] = None
+        if current is not fade:
+            # Cancelled or replaced meanwhile.
+            return
+        if task.cancelled():
+            result = 'cancelled'
+        else:
+            result = task.exception() or task.result()
+        if result is not True:
+            _LOGGER.warning("Volume fade aborted for %s, write failed: %s", player.name, result)
+            del self._fades[player]
+        elif fade['done']:
+            del self._fades[player]
+
+    async def _async_run(self):
+        # Writes aren't awaited here, a slow player must not hold up the fades of the others.
+        # It is skipped on the ticks until its write has finished.
+        while self._fades:
+            now = time.monotonic()
+            for player, fade in list(self._fades.items()):
+                if fade['inflight'] is not None:
+                    continue
+                if fade['duration'] > 0:
+                    progress = min((now - fade['started']) / fade['duration'], 1)
+                else:
+                    progress = 1
+                level = round(fade['start'] + (fade['target'] - fade['start']) * fade['curve'](progress))
+                fade['done'] = progress >= 1
+                if level == fade['written']:
+                    if fade['done']:
+                        del self._fades[player]
+                    continue
+                if not fade['done'] and now - fade['written_at'] < FADE_MIN_WRITE_INTERVAL:
+                    continue
+                fade['written'] = level
+                fade['written_at'] = now
+                fade['inflight'] = asyncio.ensure_future(self._async_write(player, fade, level))
+                fade['inflight'].add_done_callback(functools.partial(self._write_done, player, fade))
+
+            if self._fades:
+                await asyncio.sleep(FADE_MIN_WRITE_INTERVAL)
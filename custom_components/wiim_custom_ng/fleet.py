@@ -0,0 +1,176 @@
+"""Probe all WiiM players at once and rank them, without running Home Assistant.
+
+python -m custom_components.wiim_custom_ng.fleet [--config /config] [--json] [host ...]
+
+Run it from the configuration directory. Home Assistant isn't needed, only aiohttp and the
+requirements in manifest.json (async-upnp-client, lxml, validators).
+"""
+import argparse
+import asyncio
+import async_timeout
+import json
+import os
+import ssl
+import statistics
+import sys
+import time
+
+import aiohttp
+
+from .client import WiiMClient
+from .const import *
+from .limiter import TrafficLimiter
+from .upnp import UpnpPool
+
+COLUMNS = [
+    ('host', 'Host', '{0}'),
+    ('name', 'Name', '{0}'),
+    ('model', 'Model', '{0}'),
+    ('firmware', 'Firmware', '{0}'),
+    ('httpapi_ms', 'HTTP API', '{0:.0f} ms'),
+    ('upnp_ms', 'UPnP', '{0:.0f} ms'),
+    ('tcp_ms', 'TCP', '{0:.0f} ms'),
+    ('tls_ms', 'TLS', '{0:.0f} ms'),
+    ('description_ms', 'description.xml', '{0:.0f} ms'),
+    ('metadata_bytes', 'Metadata', '{0} B'),
+    ('errors', 'Errors', '{0}'),
+]
+
+
+def configured_hosts(config_dir):
+    """Return the hosts of the config entries of this integration."""
+    path = os.path.join(config_dir, '.storage', 'core.config_entries')
+    try:
+        with open(path, encoding='utf-8') as file:
+            entries = json.load(file)['data']['entries']
+    except (OSError, ValueError, KeyError):
+        return []
+    return [entry['data'][CONF_HOST] for entry in entries if entry.get('domain') == DOMAIN and entry.get('data', {}).get(CONF_HOST)]
+
+
+async def _async_timed(coro):
+    started = time.perf_counter()
+    result = await coro
+    return result, (time.perf_counter() - started) * 1000
+
+
+async def async_measure_connect(host, port, timeout):
+    """Return (TCP connect ms, TLS handshake ms) of host."""
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    async with async_timeout.timeout(timeout):
+        (_, writer), tcp_ms = await _async_timed(asyncio.open_connection(host, port))
+        writer.close()
+        (_, writer), tls_ms = await _async_timed(asyncio.open_connection(host, port, ssl=context))
+        writer.close()
+    return tcp_ms, max(tls_ms - tcp_ms, 0)
+
+
+async def async_probe(session, limiter, upnp, host, samples, timeout):
+    """Measure one player, failures are collected in 'errors' instead of raised."""
+    client = WiiMClient(session, host, limiter, upnp)
+    result = {key: None for key, _, _ in COLUMNS}
+    result['host'] = host
+    errors = []
+
+    status = await client.async_httpapi("getStatusEx", True, timeout)
+    if isinstance(status, dict):
+        result['name'] = status.get('DeviceName')
+        result['model'] = MODEL_MAP.get(status.get('project'), status.get('project'))
+        result['firmware'] = status.get('firmware')
+    else:
+        errors.append('httpapi')
+
+    rtts = []
+    for _ in range(samples):
+        value, elapsed = await _async_timed(client.async_httpapi("getPlayerStatus", True, timeout))
+        if isinstance(value, dict):
+            rtts.append(elapsed)
+    if rtts:
+        result['httpapi_ms'] = statistics.median(rtts)
+
+    try:
+        result['tcp_ms'], result['tls_ms'] = await async_measure_connect(host, 443, timeout)
+    except (OSError, asyncio.TimeoutError):
+        errors.append('tls')
+
+    try:
+        async with async_timeout.timeout(timeout):
+            started = time.perf_counter()
+            async with session.get("http://{0}:49152/description.xml".format(host)) as response:
+                await response.read()
+            result['description_ms'] = (time.perf_counter() - started) * 1000
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        errors.append('description')
+
+    device = await client.async_create_upnp_device()
+    if device is not None:
+        transport = device.service('urn:schemas-upnp-org:service:AVTransport:1')
+        rtts = []
+        info = None
+        for _ in range(samples):
+            try:
+                info, elapsed = await _async_timed(client.async_upnp_action(transport, "GetInfoEx"))
+                rtts.append(elapsed)
+            except Exception:
+                pass
+        if rtts:
+            result['upnp_ms'] = statistics.median(rtts)
+        else:
+            errors.append('upnp')
+        if info is not None:
+            result['metadata_bytes'] = len(info.get('TrackMetaData') or '')
+    else:
+        errors.append('upnp')
+
+    result['errors'] = ','.join(errors) or None
+    return result
+
+
+async def async_probe_fleet(hosts, samples=3, timeout=API_TIMEOUT_MAX):
+    """Probe all hosts concurrently, slowest first."""
+    limiter = TrafficLimiter()
+    upnp = UpnpPool()
+    async with aiohttp.ClientSession() as session:
+        try:
+            results = await asyncio.gather(*[
+                async_probe(session, limiter, upnp, host, samples, timeout) for host in hosts
+            ])
+        finally:
+            await upnp.async_close()
+    return sorted(results, key=lambda result: -(result['httpapi_ms'] if result['httpapi_ms'] is not None else float('inf')))
+
+
+def format_table(results):
+    """Return results as a text table."""
+    rows = [[title for _, title, _ in COLUMNS]]
+    for result in results:
+        rows.append([fmt.format(result[key]) if result[key] is not None else '-' for key, _, fmt in COLUMNS])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(COLUMNS))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='fleet', description="Probe WiiM players concurrently and rank them by HTTP API round-trip time.")
+    parser.add_argument('hosts', nargs='*', help="hosts to probe, in addition to the configured ones")
+    parser.add_argument('--config', default=os.environ.get('HASS_CONFIG', '/config'), help="Home Assistant configuration directory")
+    parser.add_argument('--samples', type=int, default=3, help="requests per round-trip measurement")
+    parser.add_argument('--timeout', type=float, default=API_TIMEOUT_MAX, help="timeout of each request in seconds")
+    parser.add_argument('--json', action='store_true', help="print JSON instead of a table")
+    args = parser.parse_args(argv)
+
+    hosts = list(dict.fromkeys(args.hosts + configured_hosts(args.config)))
+    if not hosts:
+        parser.error("no hosts given and none configured in {0}".format(args.config))
+
+    results = asyncio.run(async_probe_fleet(hosts, args.samples, args.timeout))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(format_table(results))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
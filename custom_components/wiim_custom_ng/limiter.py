@@ -0,0 +1,97 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from .const import *
+
+
+class TokenBucket:
+    """Token bucket, refilled at rate tokens per second up to burst tokens."""
+
+    def __init__(self, rate, burst):
+        """Initialize the bucket full."""
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def async_acquire(self):
+        """Wait until a token is available and take it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+    def idle(self):
+        """Return whether the bucket is full and nobody waits on it, so it can be dropped."""
+        if self._lock.locked():
+            return False
+        return self._tokens + (time.monotonic() - self._updated) * self._rate >= self._burst
+
+
+class TrafficLimiter:
+    """Rate limit per host and cap the number of requests in flight for the whole integration."""
+
+    def __init__(self, rate=LIMIT_HOST_RATE, burst=LIMIT_HOST_BURST, max_inflight=LIMIT_MAX_INFLIGHT, max_hosts=LIMIT_MAX_HOSTS):
+        """Initialize the limiter, state is kept for at most max_hosts hosts."""
+        self._rate = rate
+        self._burst = burst
+        self._max_hosts = max_hosts
+        self._buckets = {}
+        self._inflight = asyncio.Semaphore(max_inflight)
+        self.inflight = 0
+        self.waits = {}
+
+    @asynccontextmanager
+    async def slot(self, host):
+        """Hold a request slot for host for the duration of the block."""
+        started = time.monotonic()
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            if len(self._buckets) >= self._max_hosts:
+                self._prune()
+            bucket = self._buckets[host] = TokenBucket(self._rate, self._burst)
+        await bucket.async_acquire()
+        async with self._inflight:
+            self._record_wait(host, time.monotonic() - started)
+            self.inflight += 1
+            try:
+                yield
+            finally:
+                self.inflight -= 1
+
+    def as_dict(self):
+        """Return queue wait statistics for diagnostics."""
+        return {
+            'inflight': self.inflight,
+            'waits': {
+                host: {
+                    'count': stats['count'],
+                    'avg_ms': round(stats['total'] / stats['count'] * 1000, 1),
+                    'max_ms': round(stats['max'] * 1000, 1),
+                }
+                for host, stats in self.waits.items()
+            },
+        }
+
+    def _prune(self):
+        # Players come and go with DHCP leases, a full bucket is the same as no bucket.
+        for host in [host for host, bucket in self._buckets.items() if bucket.idle()]:
+            del self._buckets[host]
+
+    def _record_wait(self, host, wait):
+        stats = self.waits.pop(host, None)
+        if stats is None:
+            stats = {'count': 0, 'total': 0.0, 'max': 0.0}
+            if len(self.waits) >= self._max_hosts:
+                del self.waits[next(iter(self.waits))]
+        self.waits[host] = stats
+        stats['count'] += 1
+        stats['total'] += wait
+        stats['max'] = max(stats['max'], wait)
@@ -1,32 +1,38 @@
 import asyncio
 import async_timeout
 import logging
+import time
+from collections import deque
+from urllib.parse import urljoin, urlparse
 
 import aiohttp
-from http import HTTPStatus
-
-from async_upnp_client.client_factory import UpnpFactory
-from async_upnp_client.aiohttp import AiohttpRequester
-from lxml import etree as ET
 
 from homeassistant.util import Throttle
 from homeassistant.util.dt import utcnow
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.restore_state import RestoreEntity
+from homeassistant.helpers.storage import Store
 
 from homeassistant.components.media_player import (
     MediaPlayerEntity,
     MediaPlayerDeviceClass,
     MediaPlayerEntityFeature,	
+    MediaPlayerEnqueue,
 )
 
-from homeassistant.components import media_source
+from homeassistant.components import media_source, ssdp
 from homeassistant.components.media_player.browse_media import (
     async_process_play_media_url,
 )
 
 from homeassistant.components.media_player.const import (
+    ATTR_MEDIA_ANNOUNCE,
+    ATTR_MEDIA_ENQUEUE,
+    ATTR_MEDIA_EXTRA,
     MediaType,
     RepeatMode
 )
@@ -42,24 +48,191 @@ from homeassistant.const import (
     STATE_UNKNOWN,
     STATE_UNAVAILABLE,
     STATE_BUFFERING,
+    EVENT_HOMEASSISTANT_STOP,
 )
 
+from .announce import AnnouncementStore
+from .browse import BrowseCache
+from .cache import ArtCache
+from .capabilities import UNSUPPORTED_RESPONSES, capability_key, command_key, probe_capabilities
+from .client import WiiMClient, WiiMState, shuffle_repeat_to_loop_mode
 from .const import *
+from .discovery import normalize_uuid
+from .fade import VolumeFader
+from .limiter import TrafficLimiter
+from .metadata import MetadataParser
+from .planner import plan_play, plan_source, plan_stop
+from .playlist import PlaylistResolver
+from .upnp import UpnpPool
+from .watchdog import LoopWatchdog
 
 _LOGGER = logging.getLogger(__name__)
 
+FEATURE_COMMANDS = {
+    'setPlayerCmd:loopmode': MediaPlayerEntityFeature.SHUFFLE_SET | MediaPlayerEntityFeature.REPEAT_SET,
+    'setPlayerCmd:seek': MediaPlayerEntityFeature.SEEK,
+    'setPlayerCmd:next': MediaPlayerEntityFeature.NEXT_TRACK,
+    'setPlayerCmd:prev': MediaPlayerEntityFeature.PREVIOUS_TRACK,
+    'setPlayerCmd:mute': MediaPlayerEntityFeature.VOLUME_MUTE,
+    'setPlayerCmd:vol': MediaPlayerEntityFeature.VOLUME_SET | MediaPlayerEntityFeature.VOLUME_STEP,
+    'setPlayerCmd:stop': MediaPlayerEntityFeature.STOP,
+    'setPlayerCmd:pause': MediaPlayerEntityFeature.PAUSE,
+}
+
 class WiiMData:
     """Storage class for platform global data."""
-    def __init__(self):
+    def __init__(self, hass):
         """Initialize the data."""
         self.entities = []
+        self.profiles = {}
+        self.capabilities = {}
+        self.limiter = TrafficLimiter()
+        self.art_cache = ArtCache(self.limiter)
+        self.playlists = PlaylistResolver(self.limiter)
+        self.browse_cache = BrowseCache(hass)
+        self.fader = VolumeFader()
+        self.announcements = AnnouncementStore(hass, self.limiter)
+        self.watchdog = LoopWatchdog()
+        self.metadata_parser = MetadataParser()
+        self.upnp = UpnpPool()
+        self._hass = hass
+        self._store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        self._ssdp_cancel = None
+        self._stop_cancel = None
+
+    async def async_load(self):
+        """Load the persisted device profiles."""
+        stored = await self._store.async_load()
+        if isinstance(stored, dict):
+            self.profiles = stored.get('profiles', {})
+            self.capabilities = stored.get('capabilities', {})
+
+    def get_profile(self, uuid):
+        """Return the stored device profile if it is recent enough to skip getStatusEx."""
+        profile = self.profiles.get(uuid) if uuid else None
+        if profile is None:
+            return None
+        if utcnow().timestamp() - profile.get('updated', 0) > PROFILE_MAX_AGE.total_seconds():
+            return None
+        return profile
+
+    def save_profile(self, device_status, description=None):
+        """Persist the relevant part of a getStatusEx response.
+
+        description is the fingerprint of the UPnP description the response belongs to.
+        """
+        uuid = device_status.get('uuid')
+        if not uuid:
+            return
+        profile = {key: device_status[key] for key in PROFILE_KEYS if key in device_status}
+        if description is not None:
+            profile['description'] = description
+        profile['updated'] = utcnow().timestamp()
+        self.profiles[uuid] = profile
+        self._store.async_delay_save(self._data_to_save, STORAGE_SAVE_DELAY)
+
+    def get_capabilities(self, device_status):
+        """Return the capabilities shared by all players of the same model and firmware."""
+        key = capability_key(device_status)
+        if key is None:
+            return probe_capabilities(device_status)
+        capabilities = self.capabilities.get(key)
+        if capabilities is not None and not capabilities.get('plm_support') and 'plm_support' in device_status:
+            # Built from a profile saved before plm_support was kept, redo it from the real response.
+            unsupported = capabilities['unsupported']
+            capabilities.clear()
+            capabilities.update(probe_capabilities(device_status), unsupported=unsupported)
+            self._store.async_delay_save(self._data_to_save, STORAGE_SAVE_DELAY)
+        if capabilities is None:
+            capabilities = self.capabilities[key] = probe_capabilities(device_status)
+            _LOGGER.debug("Capabilities of %s: %s", key, capabilities)
+            self._store.async_delay_save(self._data_to_save, STORAGE_SAVE_DELAY)
+        return capabilities
+
+    def mark_unsupported(self, capabilities, cmd):
+        """Remember a command the model/firmware doesn't know."""
+        key = command_key(cmd)
+        if key not in capabilities['unsupported']:
+            _LOGGER.info("Command %s is not supported, it won't be sent to this model/firmware again", key)
+            capabilities['unsupported'].append(key)
+            self._store.async_delay_save(self._data_to_save, STORAGE_SAVE_DELAY)
+
+    def _data_to_save(self):
+        return {'profiles': self.profiles, 'capabilities': self.capabilities}
+
+    async def async_start_rediscovery(self):
+        """Follow players to new addresses over SSDP, release shared resources when Home Assistant stops."""
+        # ssdp is only an after dependency, without it players keep their configured address.
+        if self._ssdp_cancel is None and "ssdp" in self._hass.config.components:
+            self._ssdp_cancel = await ssdp.async_register_callback(
+                self._hass, self._async_ssdp_seen, {ssdp.ATTR_UPNP_DEVICE_TYPE: DISCOVERY_ST})
+        if self._stop_cancel is None:
+            self._stop_cancel = self._hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, self._async_hass_stop)
+
+    async def _async_hass_stop(self, event):
+        self._stop_cancel = None
+        await self.async_shutdown()
+
+    async def async_shutdown(self):
+        """Release the shared resources once no config entry is loaded."""
+        if self._stop_cancel is not None:
+            self._stop_cancel()
+            self._stop_cancel = None
+        if self._ssdp_cancel is not None:
+            self._ssdp_cancel()
+            self._ssdp_cancel = None
+        self.watchdog.stop()
+        await self.upnp.async_close()
+
+    @callback
+    def _async_ssdp_seen(self, discovery_info, change):
+        if change == ssdp.SsdpChange.BYEBYE:
+            return
+        host = urlparse(discovery_info.ssdp_location or '').hostname
+        uuid = normalize_uuid(discovery_info.upnp.get(ssdp.ATTR_UPNP_UDN) or discovery_info.ssdp_udn)
+        if not host or uuid is None:
+            return
+        device = self.get_by_uuid(uuid)
+        if device is not None:
+            device.async_host_seen(host)
+
+    def get_by_uuid(self, uuid):
+        """Return the player with the given uuid or UDN."""
+        uuid = normalize_uuid(uuid)
+        if uuid is None:
+            return None
+        for device in self.entities:
+            if normalize_uuid(device.uuid) == uuid:
+                return device
+        return None
+
+    def get_by_entity_id(self, entity_id):
+        """Return the player with the given entity id."""
+        for device in self.entities:
+            if device.entity_id == entity_id:
+                return device
+        return None
 
 # async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
+@callback
+def async_adopt_unique_id(hass, entry: ConfigEntry, uuid):
+    """Give an entry created before discovery the unique id the discovery flows match on."""
+    unique_id = normalize_uuid(uuid)
+    if entry.unique_id is not None or unique_id is None:
+        return
+    for other in hass.config_entries.async_entries(DOMAIN):
+        if other.unique_id == unique_id:
+            _LOGGER.warning("Player %s is configured twice (%s and %s), remove one of the entries",
+                unique_id, other.title, entry.title)
+            return
+    hass.config_entries.async_update_entry(entry, unique_id=unique_id)
+
 async def async_setup_entry(hass, entry: ConfigEntry, async_add_entities: AddEntitiesCallback) -> bool:
     """Set up the WiiM platform."""
 
     if DOMAIN not in hass.data:
-        hass.data[DOMAIN] = WiiMData()
+        hass.data[DOMAIN] = WiiMData(hass)
+        await hass.data[DOMAIN].async_load()
 
     host = entry.data.get(CONF_HOST)
     name = entry.data.get(CONF_NAME)
@@ -68,39 +241,34 @@ async def async_setup_entry(hass, entry: ConfigEntry, async_add_entities: AddEnt
 
     state = STATE_IDLE
 
-    initurl = "https://{0}/httpapi.asp?command=getStatusEx".format(host)
-    
-    try:
-        websession = async_get_clientsession(hass)
-        response = await websession.get(initurl, ssl=False)
+    if hass.data[DOMAIN].get_profile(uuid) is not None:
+        # Known device, the profile restores everything getStatusEx would tell us here.
+        wiim = WiiMDevice(name, host, volume_step, uuid, state, hass)
+        async_add_entities([wiim])
+        return True
+
+    # Through the client, so the request is timed out and queued in the limiter like every other.
+    client = WiiMClient(async_get_clientsession(hass), host, hass.data[DOMAIN].limiter, hass.data[DOMAIN].upnp, name)
+    data = await client.async_httpapi("getStatusEx", True, API_TIMEOUT_MAX)
+
+    if isinstance(data, dict):
+        _LOGGER.debug("HOST: %s DATA response: %s", host, data)
 
-        if response.status == HTTPStatus.OK:
-            data = await response.json(content_type=None)
-            _LOGGER.debug("HOST: %s DATA response: %s", host, data)
+        try:
+            uuid = data['uuid']
+            async_adopt_unique_id(hass, entry, uuid)
+        except KeyError:
+            pass
 
+        if name == None:
             try:
-                uuid = data['uuid']
+                name = data['DeviceName']
             except KeyError:
                 pass
 
-            if name == None:
-                try:
-                    name = data['DeviceName']
-                except KeyError:
-                    pass
-
-        else:
-            _LOGGER.warning(
-                "Get Status UUID failed, response code: %s Full message: %s",
-                response.status,
-                response,
-            )
-            state = STATE_UNAVAILABLE
-
-    except (asyncio.TimeoutError, aiohttp.ClientError) as error:
-        _LOGGER.warning(
-            "Failed communicating with WiiM (start) '%s': uuid: %s %s", host, uuid, type(error)
-        )
+        hass.data[DOMAIN].save_profile(data)
+    else:
+        _LOGGER.warning("Failed communicating with WiiM (start) '%s': uuid: %s", host, uuid)
         state = STATE_UNAVAILABLE
 
     wiim = WiiMDevice(name, 
@@ -113,7 +281,7 @@ async def async_setup_entry(hass, entry: ConfigEntry, async_add_entities: AddEnt
     async_add_entities([wiim])
     return True
 		
-class WiiMDevice(MediaPlayerEntity):
+class WiiMDevice(MediaPlayerEntity, RestoreEntity):
     """WiiM Player Object."""
 
     def __init__(self, 
@@ -127,8 +295,6 @@ class WiiMDevice(MediaPlayerEntity):
         self._uuid = uuid
         self._fw_ver = '1.0.0'
         self._device_model = 'Unknown'
-        requester = AiohttpRequester(UPNP_TIMEOUT)
-        self._factory = UpnpFactory(requester)
         self._upnp_device = None
         self._service_transport = None
         self._service_control = None
@@ -136,6 +302,7 @@ class WiiMDevice(MediaPlayerEntity):
         self._preset_key = 6
         self._name = name
         self._host = host
+        self._client = WiiMClient(async_get_clientsession(hass), host, hass.data[DOMAIN].limiter, hass.data[DOMAIN].upnp, name)
         self._icon = ICON_DEFAULT
         self._state = state
         self._volume = 0
@@ -165,6 +332,27 @@ class WiiMDevice(MediaPlayerEntity):
         self._player_mediainfo = {}
         self._player_deviceinfo = {}
         self._first_update = True
+        self._force_probe = False
+        self._description = None
+        self._upnp_latencies = deque(maxlen=HEDGE_SAMPLES)
+        self._slow_lane_at = None
+        self._device_info_at = None
+        self._queue = []
+        self._queue_next = None
+        self._queue_prefetch = None
+        self._queue_active = False
+        self._queue_end_check = None
+        self._queue_item_started = False
+        self._media_command = None
+        self._announce_lock = asyncio.Lock()
+        self._parse_stats = {'count': 0, 'last_bytes': 0, 'last_ms': 0, 'max_ms': 0}
+        self._track_identity = None
+        self._capabilities = None
+        self._track_event = None
+        self._update_task = None
+        self._update_generation = None
+        self._updated_at = None
+        self._generation = 0
 
         self._pl_tracks = None
         self._pl_trackc = None
@@ -176,6 +364,9 @@ class WiiMDevice(MediaPlayerEntity):
         self._playing_mediabrowser = False
         self._wait_for_mcu = 0
         self._unav_throttle = False
+        self._retry_at = None
+        self._retry_delay = UNA_THROTTLE
+        self._port_closed = False
         self._samplerate = None
         self._bitrate = None
         self._bitdepth = None
@@ -185,133 +376,350 @@ class WiiMDevice(MediaPlayerEntity):
         self._master_uuid = None
 
     async def async_added_to_hass(self):
-        """Record entity."""
+        """Record entity and restore the last known device profile and state."""
+        await super().async_added_to_hass()
         self.hass.data[DOMAIN].entities.append(self)
 
+        profile = self.hass.data[DOMAIN].profiles.get(self._uuid) if self._uuid else None
+        if profile is not None:
+            self.apply_device_status(profile)
+
+        last_state = await self.async_get_last_state()
+        if last_state is None:
+            return
+
+        attrs = last_state.attributes
+        if self._state != STATE_UNAVAILABLE and last_state.state in [STATE_PLAYING, STATE_PAUSED, STATE_IDLE]:
+            self._state = last_state.state
+        if attrs.get('volume_level') is not None:
+            self._volume = int(round(float(attrs['volume_level']) * MAX_VOL))
+        self._muted = bool(attrs.get('is_volume_muted', self._muted))
+        self._media_title = attrs.get('media_title')
+        self._media_artist = attrs.get('media_artist')
+        self._media_album = attrs.get('media_album_name')
+        self._source = attrs.get('source')
+        self._shuffle = bool(attrs.get('shuffle', self._shuffle))
+        self._repeat = attrs.get('repeat', self._repeat)
+        if profile is None:
+            self._fw_ver = attrs.get(ATTR_FWVER, self._fw_ver)
+            self._device_model = attrs.get(ATTR_DEVMODEL, self._device_model)
+            self._fixed_volume = attrs.get(ATTR_FIXED_VOL, self._fixed_volume)
+
+    async def async_will_remove_from_hass(self):
+        """Forget entity and stop its background work."""
+        if self in self.hass.data[DOMAIN].entities:
+            self.hass.data[DOMAIN].entities.remove(self)
+        for task in [self._update_task, self._queue_prefetch]:
+            if task is not None and not task.done():
+                task.cancel()
+        self._update_task = None
+        self._queue_prefetch = None
+        if self._queue_end_check is not None:
+            self._queue_end_check()
+            self._queue_end_check = None
+        self._upnp_device = None
+        self._service_transport = None
+        self._service_control = None
+
+    @property
+    def uuid(self):
+        """Return the uuid reported by the device."""
+        return self._uuid
+
+    @callback
+    def async_host_seen(self, host):
+        """Handle an SSDP announcement of this player at host."""
+        if host != self._host:
+            _LOGGER.info("%s moved from %s to %s", self._name, self._host, host)
+            self._host = host
+            self._client.host = host
+            self._upnp_device = None
+            self._service_transport = None
+            self._service_control = None
+            entry = None
+            if self.registry_entry is not None and self.registry_entry.config_entry_id is not None:
+                entry = self.hass.config_entries.async_get_entry(self.registry_entry.config_entry_id)
+            if entry is not None and entry.data.get(CONF_HOST) != host:
+                self.hass.config_entries.async_update_entry(entry, data={**entry.data, CONF_HOST: host})
+        elif self._state != STATE_UNAVAILABLE:
+            return
+
+        # Poll right away instead of waiting out the retry backoff.
+        self._unav_throttle = False
+        self.invalidate_update()
+        self._retry_at = None
+        self._retry_delay = UNA_THROTTLE
+        self.async_schedule_update_ha_state(True)
+
+    def apply_device_status(self, device_status):
+        """Take over device level info from a getStatusEx response or a stored profile."""
+        try:
+            self._uuid = device_status['uuid']
+        except KeyError:
+            pass
+
+        try:
+            self._name = device_status['DeviceName']
+            self._client.name = self._name
+        except KeyError:
+            pass
+
+        try:
+            self._fw_ver = device_status['firmware']
+        except KeyError:
+            self._fw_ver = '1.0.0'
+
+        try:
+            self._device_model = MODEL_MAP.get(device_status['project'], 'Unknown')
+        except KeyError:
+            self._device_model = 'Unknown'
+
+        try:
+            self._fixed_volume = device_status['volume_control']
+        except KeyError:
+            pass
+
+        self._capabilities = self.hass.data[DOMAIN].get_capabilities(device_status)
+        self._preset_key = self._capabilities['presets']
+
 		
+    def is_unsupported(self, cmd):
+        """Return True if the model/firmware is known not to support cmd."""
+        return self._capabilities is not None and command_key(cmd) in self._capabilities['unsupported']
+
     async def call_wiim_httpapi(self, cmd, jsn):
         """Get the latest data from HTTPAPI service."""
-        _LOGGER.debug("For: %s  cmd: %s  jsn: %s", self._name, cmd, jsn)
-        url = "https://{0}/httpapi.asp?command={1}".format(self._host, cmd)
-        
-        if self._first_update:
-            timeout = 10
-        else:
-            timeout = API_TIMEOUT
-        
+        if self.is_unsupported(cmd):
+            _LOGGER.debug("For: %s  cmd: %s  not supported, not sent", self._name, cmd)
+            return False
         try:
-            websession = async_get_clientsession(self.hass)
-            async with async_timeout.timeout(timeout):
-                response = await websession.get(url, ssl=False)
+            data = await self._client.async_httpapi(cmd, jsn, API_TIMEOUT_MAX if self._first_update else None)
+        finally:
+            if not cmd.startswith('get'):
+                # Bumped once the player has the command, updates started before can't show its effect.
+                self.invalidate_update()
+        if isinstance(data, str) and data.strip().lower() in UNSUPPORTED_RESPONSES and self._capabilities is not None:
+            self.hass.data[DOMAIN].mark_unsupported(self._capabilities, cmd)
+        return data
 
-        except (asyncio.TimeoutError, aiohttp.ClientError) as error:
-            _LOGGER.warning(
-                "Failed communicating with WiiM (httpapi) '%s': %s", self._name, type(error)
-            )
-            return False
+    async def async_status_via_upnp(self, slow_lane):
+        """Fetch transport and rendering info over UPnP, media info only on the slow lane."""
+        if self._upnp_device is None:
+            return None
+        if self._service_transport is None:
+            self._service_transport = self._upnp_device.service('urn:schemas-upnp-org:service:AVTransport:1')
+        if self._service_control is None:
+            self._service_control = self._upnp_device.service('urn:schemas-upnp-org:service:RenderingControl:1')
 
-        if response.status == HTTPStatus.OK:
-            if jsn:
-                data = await response.json(content_type=None)
-            else:
-                data = await response.text()
-                _LOGGER.debug("For: %s  cmd: %s  resp: %s", self._name, cmd, data)
-        else:
-            _LOGGER.error(
-                "For: %s (%s) Get failed, response code: %s Full message: %s",
-                self._name,
-                self._host,
-                response.status,
-                response,
-            )
-            return False
+        started = time.monotonic()
+        try:
+            # Mute can change from the app or a remote at any time, it stays on the fast lane.
+            actions = [
+                self._client.async_upnp_action(self._service_transport, "GetInfoEx"),
+                self._client.async_upnp_action(self._service_control, "GetControlDeviceInfo"),
+            ]
+            if slow_lane:
+                actions.append(self._client.async_upnp_action(self._service_transport, "GetMediaInfo"))
+            results = await asyncio.gather(*actions)
+            resp1, resp2 = results[0], results[1]
+            resp3 = results[2] if slow_lane else self._player_mediainfo
+            _LOGGER.debug("GetInfoEx for: %s, UPNP data: %s", self.entity_id, resp1)
+        except asyncio.CancelledError:
+            # Lost the race against the HTTP API, still a lower bound of the UPnP latency.
+            self._upnp_latencies.append(time.monotonic() - started)
+            raise
+        except Exception:
+            _LOGGER.debug('Unable to get status via UPnP: %s, %s', self.entity_id, self._name)
+            self._upnp_device = None
+            self._service_transport = None
+            self._service_control = None
+            return None
 
-        return data
+        self._upnp_latencies.append(time.monotonic() - started)
+        if slow_lane:
+            self._slow_lane_at = utcnow()
+        return resp1, resp2, resp3
+
+    async def async_status_via_httpapi(self):
+        """Fetch getPlayerStatus and normalize it to the UPnP status model."""
+        return await self._client.async_player_status(self._player_statdata)
+
+    def hedge_deadline(self):
+        """Time to wait for UPnP before also asking the HTTP API, from its p95 latency."""
+        if len(self._upnp_latencies) < HEDGE_MIN_SAMPLES:
+            return HEDGE_MAX_DELAY
+        samples = sorted(self._upnp_latencies)
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        return min(max(p95, HEDGE_MIN_DELAY), HEDGE_MAX_DELAY)
+
+    def check_description(self, device):
+        """Probe getStatusEx again when the UPnP description differs from the stored profile's.
+
+        A firmware update comes with a new softwareVersion, the stored profile and the
+        capabilities keyed on the old firmware would be used until the profile expired.
+        """
+        version = device.xml.findtext('{urn:schemas-upnp-org:device-1-0}softwareVersion') or \
+            device.xml.findtext('{urn:schemas-upnp-org:device-1-0}firmwareVersion')
+        self._description = "{0}|{1}".format(device.udn, version)
+        profile = self.hass.data[DOMAIN].profiles.get(self._uuid) if self._uuid else None
+        if profile is not None and profile.get('description') != self._description:
+            _LOGGER.debug("Description of %s changed to %s, probing getStatusEx", self._name, self._description)
+            self._force_probe = True
+
+    def slow_lane_due(self):
+        """Whether playlist info has to be refreshed along with the transport info."""
+        if not self._player_mediainfo or self._slow_lane_at is None:
+            return True
+        return utcnow() >= self._slow_lane_at + SLOW_LANE_INTERVAL
+
+    async def async_fetch_status(self):
+        """Get status over UPnP, hedged with the HTTP API when UPnP is slow or down."""
+        if self._upnp_device is None:
+            return await self.async_status_via_httpapi()
+
+        primary = asyncio.create_task(self.async_status_via_upnp(self.slow_lane_due()))
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_deadline())
+        if primary in done and self._task_status(primary) is not None:
+            return primary.result()
+
+        pending = {asyncio.create_task(self.async_status_via_httpapi())}
+        if primary not in done:
+            _LOGGER.debug("UPnP slow for: %s, hedging with HTTP API", self._name)
+            pending.add(primary)
+
+        result = None
+        while pending and result is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if result is None:
+                    result = self._task_status(task)
+        for task in pending:
+            task.cancel()
+        return result
+
+    def _task_status(self, task):
+        # A lane failing unexpectedly must not abort the poll, the other lane may still answer.
+        if task.cancelled():
+            return None
+        if task.exception() is not None:
+            _LOGGER.warning("Status request failed for: %s, %s", self._name, repr(task.exception()))
+            return None
+        return task.result()
 
-		
     @Throttle(UNA_THROTTLE)
     async def async_get_status(self):
-        resp1 = False
-        resp2 = False
-        resp3 = False
-        if self._upnp_device is not None:
-            if self._service_transport is None:
-                self._service_transport = self._upnp_device.service('urn:schemas-upnp-org:service:AVTransport:1')
-            if self._service_control is None:
-                self._service_control = self._upnp_device.service('urn:schemas-upnp-org:service:RenderingControl:1')
-
-            resp1 = dict()
-            resp2 = dict()
-            resp3 = dict()
-            try:
-                resp1 = await self._service_transport.action("GetInfoEx").async_call(InstanceID=0)
-                _LOGGER.debug("GetInfoEx for: %s, UPNP data: %s", self.entity_id, resp1)
-                resp2 = await self._service_control.action("GetControlDeviceInfo").async_call(InstanceID=0)
-                #_LOGGER.debug("GetControlDeviceInfo for: %s, UPNP data: %s", self.entity_id, resp2)
-                resp3 = await self._service_transport.action("GetMediaInfo").async_call(InstanceID=0)
-                #_LOGGER.debug("GetMediaInfo for: %s, UPNP data: %s", self.entity_id, resp3)
-            except:
-                resp1 = False
-                resp2 = False
-                resp3 = False
-        if resp1 is False or resp2 is False or resp3 is False:
-            _LOGGER.debug('Unable to connect to device via UPnP: %s, %s', self.entity_id, self._name)
-            self._state = STATE_UNAVAILABLE
-            self._unav_throttle = True
-            self._wait_for_mcu = 0
-            self._playhead_position = None
-            self._duration = None
-            self._position_updated_at = None
-            self._media_title = None
-            self._media_artist = None
-            self._media_album = None
-            self._media_image_url = None
-            self._media_uri = None
-            self._media_uri_final = None
-            self._media_source_uri = None
-            self._trackc = None
-            self._pl_tracks = None
-            self._pl_trackc = None
-            self._playing_mediabrowser = False
-            self._playing_stream = False
-            self._playing_liveinput = False
-            self._playing_connect = False
-            self._source = None
-            self._upnp_device = None
-            self._first_update = True
-            self._player_statdata = None
-            self._player_mediainfo = None
-            self._player_deviceinfo = None
-            self._service_transport = None
-            self._service_control = None
-            self._icon = ICON_DEFAULT
-            self._samplerate = None
-            self._bitrate = None
-            self._bitdepth = None
-            self._features = None	
-            self._slave = None
-            self._master_uuid = None			
+        status = await self.async_fetch_status()
+        if status is None:
+            _LOGGER.debug('Unable to connect to device via UPnP or HTTP API: %s, %s', self.entity_id, self._name)
+            self.mark_unavailable()
             return
+        resp1, resp2, resp3 = status
         self._player_statdata = resp1.copy()
         self._player_deviceinfo = resp2.copy()
         self._player_mediainfo = resp3.copy()
+
+    def mark_unavailable(self):
+        """Forget the playback state of a player that doesn't answer."""
+        self._state = STATE_UNAVAILABLE
+        self._unav_throttle = True
+        self._retry_at = utcnow() + self._retry_delay
+        self._retry_delay = min(self._retry_delay * 2, HOST_RETRY_MAX)
+        self._wait_for_mcu = 0
+        self._playhead_position = None
+        self._duration = None
+        self._position_updated_at = None
+        self._media_title = None
+        self._media_artist = None
+        self._media_album = None
+        self._media_image_url = None
+        self._media_uri = None
+        self._media_uri_final = None
+        self._media_source_uri = None
+        self._trackc = None
+        self._pl_tracks = None
+        self._pl_trackc = None
+        self._playing_mediabrowser = False
+        self._playing_stream = False
+        self._playing_liveinput = False
+        self._playing_connect = False
+        self._source = None
+        self._upnp_device = None
+        self._first_update = True
+        self._player_statdata = None
+        self._player_mediainfo = None
+        self._player_deviceinfo = None
+        self._service_transport = None
+        self._service_control = None
+        self._icon = ICON_DEFAULT
+        self._samplerate = None
+        self._bitrate = None
+        self._bitdepth = None
+        self._features = None	
+        self._slave = None
+        self._master_uuid = None			
 		
     async def async_trigger_schedule_update(self, before):
         await self.async_schedule_update_ha_state(before)	
 
 
+    def invalidate_update(self):
+        """Make the next update fetch, instead of joining or reusing one started before."""
+        self._generation += 1
+
     async def async_update(self):
-        """Update state."""
+        """Update state, concurrent callers share one in-flight update.
+
+        Commands bump the generation, an update started in an older one is neither
+        joined nor counted as fresh.
+        """
+        while self._update_task is not None and not self._update_task.done():
+            if self._update_generation == self._generation:
+                await asyncio.shield(self._update_task)
+                return
+            # Let the stale update finish first, it must not overwrite the newer state.
+            await asyncio.wait([self._update_task])
+        fresh = (
+            self._updated_at is not None
+            and self._update_generation == self._generation
+            and time.monotonic() - self._updated_at < UPDATE_FRESH_WINDOW
+        )
+        if fresh and not self._first_update:
+            return
+        self._update_generation = self._generation
+        self._update_task = asyncio.ensure_future(self._async_update_status())
+        await asyncio.shield(self._update_task)
+
+    async def _async_update_status(self):
         #_LOGGER.debug("01 Start update %s, %s", self.entity_id, self._name)
+        try:
+            await self._async_poll()
+        finally:
+            self._updated_at = time.monotonic()
+
+    async def _async_poll(self):
+
+        if self._upnp_device is None or self._unav_throttle:
+            # A TCP connect is all an offline player costs, the full reconnect waits for an open port.
+            if not await self._client.async_reachable():
+                self._port_closed = True
+                if self._state != STATE_UNAVAILABLE:
+                    _LOGGER.debug('Ports closed, device unreachable: %s, %s', self.entity_id, self._name)
+                    self.mark_unavailable()
+                return
+            if self._port_closed:
+                self._port_closed = False
+                self._unav_throttle = False
+                self._retry_at = None
+                self._retry_delay = UNA_THROTTLE
+
+        if self._unav_throttle and self._retry_at is not None and utcnow() < self._retry_at:
+            # Still unreachable, wait for the retry time or an SSDP announcement.
+            return
 
         if self._upnp_device is None: 
-            url = "http://{0}:49152/description.xml".format(self._host)
-            try:
-                self._upnp_device = await self._factory.async_create_device(url)
-            except:
-                _LOGGER.warning(
-                    "Failed communicating with WiiM (UPnP) '%s' at %s", self._name, self._host
-                )
+            self._upnp_device = await self._client.async_create_upnp_device()
+            if self._upnp_device is not None:
+                self.check_description(self._upnp_device)
 
         if self._unav_throttle:
             await self.async_get_status()
@@ -324,45 +732,26 @@ class WiiMDevice(MediaPlayerEntity):
 
         if isinstance(self._player_statdata, dict):
             self._unav_throttle = False
-            if self._first_update or (self._state == STATE_UNAVAILABLE):
+            self._retry_at = None
+            self._retry_delay = UNA_THROTTLE
+            device_info_due = self._device_info_at is not None and utcnow() >= self._device_info_at + DEVICE_INFO_INTERVAL
+            if self._first_update or (self._state == STATE_UNAVAILABLE) or device_info_due:
                 #_LOGGER.debug("03 Update first time getStatusEx %s, %s", self.entity_id, self._name)
-                device_status = await self.call_wiim_httpapi("getStatusEx", True)
+                device_status = None
+                if not self._force_probe and not device_info_due:
+                    device_status = self.hass.data[DOMAIN].get_profile(self._uuid)
+                if device_status is None:
+                    device_status = await self.call_wiim_httpapi("getStatusEx", True)
+                    if isinstance(device_status, dict):
+                        self.hass.data[DOMAIN].save_profile(device_status, self._description)
+                        self._force_probe = False
                 if device_status is not None:
                     if isinstance(device_status, dict):
                         if self._state == STATE_UNAVAILABLE:
                             self._state = STATE_IDLE
-                        
-                        try:
-                            self._uuid = device_status['uuid']
-                        except KeyError:
-                            pass
-
-                        try:
-                            self._name = device_status['DeviceName']
-                        except KeyError:
-                            pass
-
-                        try:
-                            self._fw_ver = device_status['firmware']
-                        except KeyError:
-                            self._fw_ver = '1.0.0'
-
-                        try:
-                            self._device_model = MODEL_MAP.get(device_status['project'], 'Unknown')
-                        except KeyError:
-                            self._device_model = 'Unknown'
-
-                        try:
-                            self._fixed_volume = device_status['volume_control']
-                        except KeyError:
-                            pass							
-
-                        try:
-                            self._preset_key = int(device_status['preset_key'])
-                        except KeyError:
-                            self._preset_key = 6
-
 
+                        self.apply_device_status(device_status)
+                        self._device_info_at = utcnow()
 
                         if self._first_update:
                             self._duration = 0
@@ -372,27 +761,17 @@ class WiiMDevice(MediaPlayerEntity):
 
             self._position_updated_at = utcnow()
 
-            self._pl_tracks = self._player_mediainfo['NrTracks']
-            self._pl_trackc = self._player_statdata['Track']
-            self._slave = self._player_statdata['SlaveFlag']
-            self._master_uuid = self._player_statdata['MasterUUID']
+            player = WiiMState(self._player_statdata, self._player_deviceinfo, self._player_mediainfo)
+            self._pl_tracks = player.tracks
+            self._pl_trackc = player.track
+            self._slave = player.slave
+            self._master_uuid = player.master_uuid
 
             #_LOGGER.debug("04 Update VOL, Shuffle, Repeat, STATE %s, %s", self.entity_id, self._name)
-            self._volume = self._player_statdata['CurrentVolume']
-            self._muted = bool(self._player_deviceinfo['CurrentMute']) 
-
-            self._shuffle = {
-                2: True,
-                3: True,
-                5: True,
-            }.get(self._player_statdata['LoopMode'], False)
-
-            self._repeat = {
-                0: RepeatMode.ALL,
-                1: RepeatMode.ONE,
-                2: RepeatMode.ALL,
-                5: RepeatMode.ONE,
-            }.get(self._player_statdata['LoopMode'], RepeatMode.OFF)
+            self._volume = player.volume
+            self._muted = player.muted
+            self._shuffle = player.shuffle
+            self._repeat = RepeatMode(player.repeat)
             
             if self._player_statdata['PlayType'] in SOURCES_IDLE or self._player_statdata['CurrentTransportState'] in ['STOPPED', 'NO_MEDIA_PRESENT']: 
                 if utcnow() >= (self._idletime_updated_at + AUTOIDLE_STATE_TIMEOUT):
@@ -409,15 +788,16 @@ class WiiMDevice(MediaPlayerEntity):
                 #_LOGGER.debug("05 DETECTED %s, %s", self.entity_id, self._state)
 
             if self._state in [STATE_PLAYING, STATE_PAUSED]:
-                x = self._player_statdata['TrackDuration']
-                self._duration = int(sum([int(x)*int(y) for x,y in zip([3600,60,1],x.split(":"))]))
-                x = self._player_statdata['RelTime']
-                self._playhead_position = int(sum([int(x)*int(y) for x,y in zip([3600,60,1],x.split(":"))]))
+                self._duration = player.duration
+                self._playhead_position = player.position
                 #_LOGGER.debug("04 Update DUR, POS %s, %s, %s, %s, %s", self.entity_id, self._name, self._state, self._duration, self._playhead_position)
             else:
                 self._duration = 0
                 self._playhead_position = 0
 
+            if self._queue_active:
+                self.track_queue_progress()
+
             #_LOGGER.debug("05 Update self._playing_whatever %s, %s", self.entity_id, self._name)
             self._playing_connect = self._player_statdata['PlayType'] in SOURCES_CONNECT		
             self._playing_liveinput = self._player_statdata['PlayType'] in SOURCES_LIVEIN
@@ -474,6 +854,7 @@ class WiiMDevice(MediaPlayerEntity):
 
             self._media_prev_artist = self._media_artist
             self._media_prev_title = self._media_title
+            self.check_track_changed()
 
             #    if self._connect_paused_at != None:
             #        if utcnow() >= (self._connect_paused_at + CONNECT_PAUSED_TIMEOUT):
@@ -489,6 +870,40 @@ class WiiMDevice(MediaPlayerEntity):
         return True
 
 
+    def check_track_changed(self):
+        """Fire EVENT_TRACK_CHANGED when the decoded track identity differs from the last poll."""
+        # The URI only counts without metadata: the HTTP API doesn't report it, so it
+        # comes and goes as polls switch between UPnP and the HTTP API.
+        identity = (self._media_title, self._media_artist, self._media_album)
+        if not any(identity):
+            identity = (self._trackc,)
+        if not any(identity):
+            # Stopping and outages aren't track changes, the same track afterwards isn't one either.
+            return
+        previous = self._track_identity
+        if identity == previous:
+            return
+        self._track_identity = identity
+        if previous is None:
+            return
+
+        event = {
+            ATTR_ENTITY_ID: self.entity_id,
+            'media_title': self._media_title,
+            'media_artist': self._media_artist,
+            'media_album_name': self._media_album,
+            'media_content_id': self._trackc,
+            'media_image_url': self._media_image_url,
+            'media_duration': self._duration,
+            'source': self._source,
+            ATTR_SAMPLERATE: self._samplerate,
+            ATTR_DEPTH: self._bitdepth,
+            ATTR_BITRATE: self._bitrate,
+            'previous': self._track_event,
+        }
+        self._track_event = {key: value for key, value in event.items() if key != 'previous'}
+        self.hass.bus.async_fire(EVENT_TRACK_CHANGED, event)
+
     @property
     def name(self):
         """Return the name of the device."""
@@ -547,11 +962,17 @@ class WiiMDevice(MediaPlayerEntity):
         """Return the list of available input sources."""
         source_list = self._source_list.copy()
 
-        if self._device_model == 'WiiM Mini' and 'optical' in source_list:
-            del source_list['optical']
+        if self._capabilities is not None:
+            source_list = {
+                source: name for source, name in source_list.items()
+                if source in self._capabilities['sources'] and not self.is_unsupported("setPlayerCmd:switchmode:" + source)
+            }
+        else:
+            if self._device_model == 'WiiM Mini' and 'optical' in source_list:
+                del source_list['optical']
 
-        if self._device_model != 'WiiM Amp' and 'HDMI' in source_list:
-            del source_list['HDMI']
+            if self._device_model != 'WiiM Amp' and 'HDMI' in source_list:
+                del source_list['HDMI']
 
         if len(source_list) > 0:
             return list(source_list.values())
@@ -593,13 +1014,30 @@ class WiiMDevice(MediaPlayerEntity):
             MediaPlayerEntityFeature.VOLUME_MUTE
         else:
             self._features = \
-            MediaPlayerEntityFeature.BROWSE_MEDIA | MediaPlayerEntityFeature.SELECT_SOURCE | \
+            MediaPlayerEntityFeature.PLAY_MEDIA | MediaPlayerEntityFeature.BROWSE_MEDIA | MediaPlayerEntityFeature.SELECT_SOURCE | \
             MediaPlayerEntityFeature.VOLUME_MUTE
 
+        if self._features & MediaPlayerEntityFeature.PLAY_MEDIA:
+            self._features |= MediaPlayerEntityFeature.MEDIA_ENQUEUE
+            self._features |= MediaPlayerEntityFeature.CLEAR_PLAYLIST
+            self._features |= MediaPlayerEntityFeature.MEDIA_ANNOUNCE
+            if self._queue_active and self._queue:
+                self._features |= MediaPlayerEntityFeature.NEXT_TRACK
+
+        self._features |= MediaPlayerEntityFeature.GROUPING
+
         if self._features is not None and self._fixed_volume == '0':
             self._features |= MediaPlayerEntityFeature.VOLUME_SET
             self._features |= MediaPlayerEntityFeature.VOLUME_STEP
 
+        if self._features is not None and self._capabilities is not None:
+            for cmd in self._capabilities['unsupported']:
+                features = FEATURE_COMMANDS.get(cmd, 0)
+                if self._queue_active and self._queue:
+                    # Skipping through the queue doesn't need the device command.
+                    features &= ~MediaPlayerEntityFeature.NEXT_TRACK
+                self._features &= ~features
+
         return self._features	
 		
     @property
@@ -656,6 +1094,18 @@ class WiiMDevice(MediaPlayerEntity):
         """Return name the image for the current track."""
         return self._media_image_url
 
+    @property
+    def media_image_remotely_accessible(self):
+        """Serve album art through the Home Assistant image proxy."""
+        return False
+
+    async def async_get_media_image(self):
+        """Fetch the image for the current track from the shared album art cache."""
+        if self._media_image_url is None:
+            return None, None
+        websession = async_get_clientsession(self.hass)
+        return await self.hass.data[DOMAIN].art_cache.async_get(websession, self._media_image_url)
+
     @property
     def media_content_type(self):
         """Content type of current playing media. Has to be MediaType.MUSIC in order for Lovelace to show both artist and title."""
@@ -731,11 +1181,50 @@ class WiiMDevice(MediaPlayerEntity):
 			
         return attributes	
 
+    def diagnostics(self):
+        """Return runtime details for the config entry diagnostics."""
+        return {
+            'name': self._name,
+            'host': self._host,
+            'uuid': self._uuid,
+            'model': self._device_model,
+            'firmware': self._fw_ver,
+            'state': self._state,
+            'upnp_connected': self._upnp_device is not None,
+            'hedge_deadline': self.hedge_deadline(),
+            'queue_length': len(self._queue),
+            'metadata_parse': self._parse_stats,
+            'rtt': {endpoint: rtt.as_dict() for endpoint, rtt in self._client.rtt.items()},
+        }
+
     @property
     def host(self):
         """Self ip."""
         return self._host
 
+    @property
+    def group_master(self):
+        """Return the master player if this one is a slave in a multiroom group."""
+        if not self._slave or not self._master_uuid:
+            return None
+        return self.hass.data[DOMAIN].get_by_uuid(self._master_uuid)
+
+    @property
+    def group_slaves(self):
+        """Return the players following this one in a multiroom group."""
+        if self._slave or not self._uuid:
+            return []
+        return [device for device in self.hass.data[DOMAIN].entities if device.group_master is self]
+
+    @property
+    def group_members(self):
+        """List of entity ids in the multiroom group, master first."""
+        master = self.group_master or self
+        slaves = master.group_slaves
+        if not slaves:
+            return None
+        return [master.entity_id] + [device.entity_id for device in slaves]
+
     @property
     def track_count(self):
         """List of tracks present on the device."""
@@ -764,6 +1253,10 @@ class WiiMDevice(MediaPlayerEntity):
     async def async_media_next_track(self):
         """Send media_next command to media player."""
 
+        if self._queue_active and self._queue:
+            await self.async_queue_next()
+            return
+
         value = await self.call_wiim_httpapi("setPlayerCmd:next", None)
         self._playhead_position = 0
         self._duration = 0
@@ -830,15 +1323,29 @@ class WiiMDevice(MediaPlayerEntity):
             _LOGGER.warning("Failed to pause playback. Device: %s, Got response: %s", self.entity_id, value)
 
 
+    def planner_state(self):
+        """Return the known state of the player the command planner starts from."""
+        return {
+            'state': self._state,
+            'connect': self._playing_connect,
+            'liveinput': self._playing_liveinput,
+            'stream': self._playing_stream,
+            'source': next((k for k in self._source_list if self._source_list[k] == self._source), None),
+        }
+
+    async def async_run_plan(self, plan):
+        """Send the commands of a plan, stage after stage, return the responses by command."""
+        try:
+            return await self._client.async_run_plan(plan)
+        finally:
+            self.invalidate_update()
+
     async def async_media_stop(self):
         """Send stop command."""
+        self._queue_active = False
  
-        if self._playing_connect or self._playing_liveinput or self._playing_stream:
-            await self.call_wiim_httpapi("setPlayerCmd:pause", None)
-            await self.call_wiim_httpapi("setPlayerCmd:switchmode:wifi", None)
-
-
-        value = await self.call_wiim_httpapi("setPlayerCmd:stop", None)
+        values = await self.async_run_plan(plan_stop(self.planner_state()))
+        value = values.get("setPlayerCmd:stop", "OK")
         if value == "OK":
             self._state = STATE_IDLE
             self._playhead_position = 0
@@ -881,33 +1388,207 @@ class WiiMDevice(MediaPlayerEntity):
                 _LOGGER.warning("Failed to seek. Device: %s, Got response: %s", self.entity_id, value)		
 
     async def async_clear_playlist(self):
-        """Clear players playlist."""
-        pass
+        """Clear the queue of upcoming media."""
+        self._queue.clear()
+        if self._queue_prefetch is not None and not self._queue_prefetch.done():
+            self._queue_prefetch.cancel()
+        self._queue_prefetch = None
+        self._queue_next = None
 
     async def async_play_media(self, media_type, media_id, **kwargs):
-        """Play media from a URL or localfile."""
+        """Play media from a URL or localfile, or put it into the queue."""
         _LOGGER.debug("Trying to play media. Device: %s, Media_type: %s, Media_id: %s", self.entity_id, media_type, media_id)
 
-        self._playing_mediabrowser = False
-
         if not (media_type in [MediaType.MUSIC, MediaType.URL] or media_source.is_media_source_id(media_id)):
             _LOGGER.warning("For: %s Invalid media type %s. Only %s and %s is supported", self._name, media_type, MediaType.MUSIC, MediaType.URL)
 
+            self._playing_mediabrowser = False
             await self.async_media_stop()
             return False
-            
+
+        if kwargs.get(ATTR_MEDIA_ANNOUNCE):
+            return await self.async_announce(media_type, media_id, kwargs.get(ATTR_MEDIA_EXTRA) or {})
+
+        enqueue = kwargs.get(ATTR_MEDIA_ENQUEUE)
+        if enqueue == MediaPlayerEnqueue.REPLACE:
+            await self.async_clear_playlist()
+        elif enqueue in [MediaPlayerEnqueue.ADD, MediaPlayerEnqueue.NEXT]:
+            if enqueue == MediaPlayerEnqueue.ADD:
+                self._queue.append((media_type, media_id))
+            else:
+                self._queue.insert(0, (media_type, media_id))
+            if self._state in [STATE_PLAYING, STATE_PAUSED, STATE_BUFFERING]:
+                self._queue_active = True
+                self.async_schedule_queue_prefetch()
+                return True
+            return await self.async_queue_next()
+
+        resolved = await self.async_resolve_media(media_type, media_id)
+        if resolved is None:
+            self._playing_mediabrowser = False
+            return False
+        result = await self.async_play_resolved(resolved)
+        self.async_schedule_queue_prefetch()
+        return result
+
+    async def async_announce(self, media_type, media_id, extra):
+        """Play a clip over the current playback and restore it afterwards."""
+        started = time.monotonic()
+        resolved = await self.async_resolve_media(media_type, media_id)
+        if resolved is None:
+            return False
+
+        store = self.hass.data[DOMAIN].announcements
+        websession = async_get_clientsession(self.hass)
+        clip_url = await store.async_prefetch(websession, resolved['media_id']) or resolved['media_id_final']
+
+        async with self._announce_lock:
+            snapshot = {
+                'state': self._state,
+                'volume': int(self._volume),
+                'source': self._source if self._playing_liveinput else None,
+                'command': self._media_command if self._playing_stream or self._playing_mediabrowser else None,
+                'position': self._playhead_position if self._playing_mediabrowser else 0,
+                'queue_active': self._queue_active,
+            }
+            self._queue_active = False
+            await self.hass.data[DOMAIN].fader.async_cancel(self)
+
+            if extra.get('volume') is not None:
+                await self.async_write_volume(round(float(extra['volume']) * MAX_VOL))
+
+            value = await self.call_wiim_httpapi("setPlayerCmd:play:{0}".format(clip_url), None)
+            skew = store.record_start(resolved['media_id'])
+            if value == "OK":
+                await self.async_wait_announcement_end()
+            else:
+                _LOGGER.warning("Failed to play announcement. Device: %s, Got response: %s", self.entity_id, value)
+
+            await self.async_restore_snapshot(snapshot)
+
+        latency = time.monotonic() - started
+        store.record_latency(latency)
+        _LOGGER.debug("Announcement on %s: start skew %.3f s, end-to-end %.2f s", self.entity_id, skew, latency)
+        return value == "OK"
+
+    async def async_wait_announcement_end(self):
+        """Poll the cheap player status until the clip stopped."""
+        started = time.monotonic()
+        seen_playing = False
+        while time.monotonic() - started < ANNOUNCE_MAX_DURATION:
+            await asyncio.sleep(ANNOUNCE_POLL_INTERVAL)
+            status = await self.call_wiim_httpapi("getPlayerStatus", True)
+            if not isinstance(status, dict):
+                continue
+            if status.get('status') in ['play', 'load']:
+                seen_playing = True
+            elif seen_playing or time.monotonic() - started > ANNOUNCE_START_TIMEOUT:
+                return
+
+    async def async_restore_snapshot(self, snapshot):
+        """Bring back volume and playback from before an announcement."""
+        volume = snapshot['volume'] if int(self._volume) != snapshot['volume'] else None
+        plan = []
+        if snapshot['state'] == STATE_PLAYING and snapshot['source'] is not None:
+            source = next((k for k in self._source_list if self._source_list[k] == snapshot['source']), None)
+            if source is not None:
+                # The announcement took the player off the source, whatever the last poll says.
+                plan = plan_source(dict(self.planner_state(), source=None), source, volume)
+        elif snapshot['state'] == STATE_PLAYING and snapshot['command'] is not None:
+            plan = plan_play(self.planner_state(), snapshot['command'], volume)
+        if not plan and volume is not None:
+            plan = [["setPlayerCmd:vol:{0}".format(volume)]]
+
+        # The volume goes out together with the first stage of the playback plan.
+        values = await self.async_run_plan(plan)
+        if volume is not None:
+            if values.get("setPlayerCmd:vol:{0}".format(volume)) == "OK":
+                self._volume = volume
+            else:
+                _LOGGER.warning("Failed to restore volume %s. Device: %s", volume, self.entity_id)
+        if snapshot['source'] is None and snapshot['command'] is not None and snapshot['position']:
+            if values.get("setPlayerCmd:{0}".format(snapshot['command'])) == "OK":
+                await self.call_wiim_httpapi("setPlayerCmd:seek:{0}".format(snapshot['position']), None)
+
+        self._queue_active = snapshot['queue_active']
+        self._queue_item_started = False
+        self._unav_throttle = False
+        self._slow_lane_at = None
+
+    async def async_queue_next(self):
+        """Start the next item of the queue, using its pre-resolved form when available."""
+        while self._queue:
+            item = self._queue.pop(0)
+            resolved = None
+            if self._queue_next is not None and self._queue_next[0] == item:
+                resolved = self._queue_next[1]
+            self._queue_next = None
+            if resolved is None:
+                resolved = await self.async_resolve_media(*item)
+            if resolved is not None and await self.async_play_resolved(resolved):
+                self.async_schedule_queue_prefetch()
+                return True
+            _LOGGER.warning("For: %s skipping queue item that can't be played: %s", self._name, item[1])
+        self._queue_active = False
+        return False
+
+    def async_schedule_queue_prefetch(self):
+        """Resolve the next queue item in the background while the current one plays."""
+        if not self._queue or (self._queue_next is not None and self._queue_next[0] == self._queue[0]):
+            return
+        if self._queue_prefetch is not None and not self._queue_prefetch.done():
+            self._queue_prefetch.cancel()
+        self._queue_prefetch = self.hass.async_create_task(self.async_queue_prefetch(self._queue[0]))
+
+    async def async_queue_prefetch(self, item):
+        resolved = await self.async_resolve_media(*item)
+        if resolved is not None and self._queue and self._queue[0] == item:
+            self._queue_next = (item, resolved)
+            _LOGGER.debug("For: %s next queue item resolved to: %s", self._name, resolved['media_id_final'])
+
+    def track_queue_progress(self):
+        """Start the next queue item when the current one ended, poll again right at its expected end."""
+        if self._queue_end_check is not None:
+            self._queue_end_check()
+            self._queue_end_check = None
+
+        # Only trust a stop once the player reported the item as playing, it briefly stops while loading.
+        if self._player_statdata['CurrentTransportState'] == 'PLAYING':
+            self._queue_item_started = True
+
+        if self._queue_item_started and self._state == STATE_IDLE:
+            self._queue_item_started = False
+            if self._queue:
+                _LOGGER.debug("For: %s track ended, playing next queue item", self._name)
+                self.hass.async_create_task(self.async_queue_next())
+            else:
+                self._queue_active = False
+            return
+
+        if self._queue and self._state == STATE_PLAYING and self._duration > 0:
+            remaining = self._duration - self._playhead_position
+            if 0 <= remaining < QUEUE_END_CHECK_WINDOW.total_seconds():
+                self._queue_end_check = async_call_later(
+                    self.hass, remaining + AUTOIDLE_STATE_TIMEOUT.total_seconds(), self._async_queue_end_check
+                )
+
+    async def _async_queue_end_check(self, _now):
+        self._queue_end_check = None
+        self.invalidate_update()
+        await self.async_update_ha_state(True)
+
+    async def async_resolve_media(self, media_type, media_id):
+        """Turn a media source id or URL into the player command, without touching the playback."""
+        mediabrowser = False
+        source_uri = None
 
         if media_source.is_media_source_id(media_id):
             play_item = await media_source.async_resolve_media(self.hass, media_id, self.entity_id)
-            if media_id.find('radio_browser') != -1:  # radios are an exception, be treated by server redirect checker
-                self._playing_mediabrowser = False
-            else:
-                self._playing_mediabrowser = True
+            # radios are an exception, be treated by server redirect checker
+            mediabrowser = media_id.find('radio_browser') == -1
 
             if media_id.find('media_source/local') != -1:
-                self._media_source_uri = media_id
-            else:
-                self._media_source_uri = None
+                source_uri = media_id
 
             media_id = play_item.url
             if not play_item.mime_type in ['audio/basic',
@@ -933,8 +1614,7 @@ class WiiMDevice(MediaPlayerEntity):
                                            'audio/x-flac', 
                                            'audio/x-ms-wma']:
                 _LOGGER.warning("For: %s Invalid media type, %s is not supported", self._name, play_item.mime_type)
-                self._playing_mediabrowser = False
-                return False
+                return None
                 
             media_id = async_process_play_media_url(self.hass, media_id)
             _LOGGER.debug("Trying to play HA media. Device: %s, Play_Item: %s, Media_id: %s", self._name, play_item, media_id)
@@ -946,40 +1626,50 @@ class WiiMDevice(MediaPlayerEntity):
 
         if not media_type in [MediaType.URL]:
             _LOGGER.warning("For: %s Invalid media type %s. Only %s is supported", self._name, media_type, MediaType.URL)
+            return None
 
-            await self.async_media_stop()
-            self._playing_mediabrowser = False
-            return False
-
-        if self._playing_mediabrowser:
+        if mediabrowser:
             media_id_final = media_id
         else:
             media_id_final = await self.async_detect_stream_url_redirection(media_id)
 
-        if self._state == STATE_PLAYING:
-            await self.call_wiim_httpapi("setPlayerCmd:pause", None)
-                
-        if self._playing_connect:  # disconnect from Spotify before playing new http source
-            await self.call_wiim_httpapi("setPlayerCmd:switchmode:wifi", None)
-
+        command = "play:{0}".format(media_id_final)
+        if media_id_check.endswith(PLAYLIST_EXTENSIONS):
+            _LOGGER.debug("For: %s, Detected playlist: %s, Media_id: %s", self._name, media_id_final, media_id)
 
-        if media_id_check.endswith('.m3u') or media_id_check.endswith('.m3u8'):
-            _LOGGER.debug("For: %s, Detected M3U list: %s, Media_id: %s", self._name, media_id_final, media_id)
-            
-            if await self.async_validate_m3u_url(media_id_final):
-                value = await self.call_wiim_httpapi("setPlayerCmd:playlist:{0}:0".format(media_id_final), None)
+            websession = async_get_clientsession(self.hass)
+            resolved = await self.hass.data[DOMAIN].playlists.async_resolve(websession, media_id_final)
+            if resolved is None:
+                return None
+            if resolved[0] == 'playlist':
+                command = "playlist:{0}:0".format(resolved[1])
             else:
-                self._playing_mediabrowser = False
-                return False
-        else:
-            value = await self.call_wiim_httpapi("setPlayerCmd:play:{0}".format(media_id_final), None)
+                command = "play:{0}".format(resolved[1])
+
+        return {'media_id': media_id,
+                'media_id_final': media_id_final,
+                'command': command,
+                'mediabrowser': mediabrowser,
+                'source_uri': source_uri}
+
+    async def async_play_resolved(self, resolved):
+        """Hand a resolved media item to the player."""
+        media_id = resolved['media_id']
+        media_id_final = resolved['media_id_final']
+
+        values = await self.async_run_plan(plan_play(self.planner_state(), resolved['command']))
+        value = values.get("setPlayerCmd:{0}".format(resolved['command']))
         if value != "OK":
+            self.hass.data[DOMAIN].playlists.invalidate(media_id_final)
             _LOGGER.warning("Failed to play media type URL. Device: %s, Got response: %s, Media_Id: %s", self.entity_id, value, media_id)
             self._playing_mediabrowser = False
             return False
 
-
         self._state = STATE_PLAYING
+        self._playing_mediabrowser = resolved['mediabrowser']
+        self._media_source_uri = resolved['source_uri']
+        self._queue_active = True
+        self._queue_item_started = False
         if media_id.find('tts_proxy') != -1:
             #_LOGGER.debug("Setting TTS: %s, %s", self.entity_id, self._name)
             self._playing_mediabrowser = False
@@ -1003,6 +1693,8 @@ class WiiMDevice(MediaPlayerEntity):
 
         self._media_uri = media_id
         self._media_uri_final = media_id_final
+        self._media_command = resolved['command']
+        self._slow_lane_at = None
 
         return True
 
@@ -1013,17 +1705,14 @@ class WiiMDevice(MediaPlayerEntity):
         if temp_source == None:
             return
 
-        if self._playing_connect:  
-            await self.call_wiim_httpapi("setPlayerCmd:pause", None)
-            await self.call_wiim_httpapi("setPlayerCmd:switchmode:wifi", None)
-
+        plan = plan_source(self.planner_state(), temp_source)
 
-        if len(self._source_list) > 0:
-            prev_source = next((k for k in self._source_list if self._source_list[k] == self._source), None)
+        self._queue_active = False
 
         self._unav_throttle = False
 
-        value = await self.call_wiim_httpapi("setPlayerCmd:switchmode:{0}".format(temp_source), None)
+        values = await self.async_run_plan(plan)
+        value = values.get("setPlayerCmd:switchmode:{0}".format(temp_source), "OK")
         if value == "OK":
             self._state = STATE_PLAYING
             self._source = source
@@ -1043,20 +1732,7 @@ class WiiMDevice(MediaPlayerEntity):
     async def async_set_shuffle(self, shuffle):
         """Change the shuffle mode."""
         self._shuffle = shuffle
-        if shuffle:
-            if self._repeat == RepeatMode.OFF:
-                mode = '3'
-            elif self._repeat == RepeatMode.ALL:
-                mode = '2'
-            elif self._repeat == RepeatMode.ONE:
-                mode = '3' #'5' is buggy
-        else:
-            if self._repeat == RepeatMode.OFF:
-                mode = '4'
-            elif self._repeat == RepeatMode.ALL:
-                mode = '0'
-            elif self._repeat == RepeatMode.ONE:
-                mode = '1'
+        mode = shuffle_repeat_to_loop_mode(shuffle, self._repeat)
         value = await self.call_wiim_httpapi("setPlayerCmd:loopmode:{0}".format(mode), None)
         if value != "OK":
             _LOGGER.warning("Failed to change shuffle mode. Device: %s, Got response: %s", self.entity_id, value)
@@ -1066,12 +1742,7 @@ class WiiMDevice(MediaPlayerEntity):
         """Change the repeat mode."""
         #_LOGGER.debug("Setting repeat: %s on %s, %s", repeat, self.entity_id, self._name) 
         self._repeat = repeat
-        if repeat == RepeatMode.OFF:
-            mode = '3' if self._shuffle else '4'
-        elif repeat == RepeatMode.ALL:
-            mode = '2' if self._shuffle else '0'
-        elif repeat == RepeatMode.ONE:
-            mode = '3' if self._shuffle else '1' #'5' is buggy
+        mode = shuffle_repeat_to_loop_mode(self._shuffle, repeat)
         value = await self.call_wiim_httpapi("setPlayerCmd:loopmode:{0}".format(mode), None)
         if value != "OK":
             _LOGGER.warning("Failed to change repeat mode. Device: %s, Got response: %s", self.entity_id, value)
@@ -1134,70 +1805,27 @@ class WiiMDevice(MediaPlayerEntity):
         if uri.find('tts_proxy') != -1: # skip redirect check for local TTS streams
             return uri
         _LOGGER.debug('For: %s detect URI redirect-from:   %s', self._name, uri)
-        redirect_detect = True
         check_uri = uri
+        websession = async_get_clientsession(self.hass)
         try:
-            while redirect_detect:
-                response_location = requests.head(check_uri, allow_redirects=False, headers={'User-Agent': 'VLC/3.0.16 LibVLC/3.0.16'})
-                #_LOGGER.debug('For: %s detecting URI redirect code: %s', self._name, str(response_location.status_code))
-                if response_location.status_code in [301, 302, 303, 307, 308] and 'Location' in response_location.headers:
-                    #_LOGGER.debug('For: %s detecting URI redirect location: %s', self._name, response_location.headers['Location'])
-                    check_uri = response_location.headers['Location']
-                else:
-                    #_LOGGER.debug('For: %s detecting URI redirect - result: %s', self._name, check_uri)
-                    redirect_detect = False
-        except:
+            for _ in range(MAX_REDIRECTS):
+                async with self.hass.data[DOMAIN].limiter.slot(urlparse(check_uri).hostname):
+                    async with async_timeout.timeout(API_TIMEOUT):
+                        async with websession.head(check_uri, allow_redirects=False, ssl=False, headers={'User-Agent': 'VLC/3.0.16 LibVLC/3.0.16'}) as response_location:
+                            #_LOGGER.debug('For: %s detecting URI redirect code: %s', self._name, str(response_location.status))
+                            if response_location.status in [301, 302, 303, 307, 308] and 'Location' in response_location.headers:
+                                #_LOGGER.debug('For: %s detecting URI redirect location: %s', self._name, response_location.headers['Location'])
+                                check_uri = urljoin(check_uri, response_location.headers['Location'])
+                            else:
+                                #_LOGGER.debug('For: %s detecting URI redirect - result: %s', self._name, check_uri)
+                                break
+        except (asyncio.TimeoutError, aiohttp.ClientError):
             pass
 
         _LOGGER.debug('For: %s detect URI redirect - to:   %s', self._name, check_uri)
         return check_uri
 	
 		
-    async def async_validate_m3u_url(self, playlist):
-        """Validate an M3U playlist URL for actual streams"""
-        try:
-            websession = async_get_clientsession(self.hass)
-            async with async_timeout.timeout(10):
-                response = await websession.get(playlist, ssl=False)
-
-        except (asyncio.TimeoutError, aiohttp.ClientError) as error:
-            _LOGGER.warning(
-                "For: %s unable to get the M3U playlist: %s", self._name, playlist
-            )
-            return False
-
-        if response.status == HTTPStatus.OK:
-            data = await response.text()
-            _LOGGER.debug("For: %s M3U playlist: %s  contents: %s", self._name, playlist, data)
-
-            lines = [line.strip("\n\r") for line in data.split("\n") if line.strip("\n\r") != ""]
-            if len(lines) > 0:
-                _LOGGER.debug("For: %s M3U playlist: %s  lines: %s", self._name, playlist, lines)
-                noturls = [u for u in lines if not u.startswith('http')]
-                _LOGGER.debug("For: %s M3U playlist: %s  not urls: %s", self._name, playlist, noturls)
-                if len(noturls) > 0:
-                    return False
-                else:
-                    return True
-            else:
-                _LOGGER.error("For: %s M3U playlist: %s No content to parse!!!", self._name, playlist)
-                return False
-        else:
-            _LOGGER.error(
-                "For: %s (%s) Get failed, response code: %s Full message: %s",
-                self._name,
-                self._host,
-                response.status,
-                response,
-            )
-            return False
-
-        return False		
-		
-		
-	
-		
-
     async def async_set_media_title(self, title):
         """Set the media title property."""
         self._media_title = title
@@ -1270,14 +1898,90 @@ class WiiMDevice(MediaPlayerEntity):
     async def async_volume(self, volume):
         if volume != None:
             if int(volume) >= 0 and int(volume) <= 100:
-                value = await self.call_wiim_httpapi("setPlayerCmd:vol:{0}".format(str(volume)), None)
-
-                if value != "OK":
-                    _LOGGER.warning("Failed to set volume %s. " "Device: %s, Got response: %s", volume, self.entity_id, value)
-                else:
-                    self._volume = volume
+                # A new volume command wins over a running fade.
+                await self.hass.data[DOMAIN].fader.async_cancel(self)
+                await self.async_write_volume(volume)
             else:
                 _LOGGER.warning("Wrong volume value %s. Device: %s, has to be integer between 0 and 100", volume, self.entity_id)
+
+    async def async_write_volume(self, volume):
+        """Send the volume to the device, return True on success."""
+        value = await self.call_wiim_httpapi("setPlayerCmd:vol:{0}".format(str(volume)), None)
+
+        if value != "OK":
+            _LOGGER.warning("Failed to set volume %s. " "Device: %s, Got response: %s", volume, self.entity_id, value)
+            return False
+        self._volume = volume
+        return True
+
+    async def async_fade_volume(self, volume, duration, curve):
+        """Fade to volume level (0..1) over duration seconds."""
+        if self._fixed_volume == '1':
+            return
+        target = round(volume * MAX_VOL)
+        _LOGGER.debug("Fade volume. Device: %s, from: %s to: %s in %s s", self.entity_id, self._volume, target, duration)
+        self.hass.data[DOMAIN].fader.start(self, int(self._volume), target, duration, curve)
+
+    async def async_join_players(self, group_members):
+        """Make this player the master of a multiroom group with group_members."""
+        members = []
+        for entity_id in group_members:
+            device = self.hass.data[DOMAIN].get_by_entity_id(entity_id)
+            if device is None:
+                _LOGGER.warning("Cannot join %s to %s, not a WiiM player", entity_id, self.entity_id)
+            elif device is not self and device.group_master is not self:
+                members.append(device)
+        if not members:
+            return
+
+        cmd = "ConnectMasterAp:JoinGroupMaster:eth{0}:wifi0.0.0.0".format(self._host)
+        results = await asyncio.gather(*[device.call_wiim_httpapi(cmd, None) for device in members])
+        for device, value in zip(members, results):
+            if value != "OK":
+                _LOGGER.warning("Failed to join %s to %s, got response: %s", device.entity_id, self.entity_id, value)
+
+        await self.async_confirm_group(lambda: all(device.group_master is self for device in members), [self] + members)
+
+    async def async_unjoin_player(self):
+        """Leave the multiroom group, a master dissolves the whole group."""
+        master = self.group_master
+        if master is not None:
+            value = await master.call_wiim_httpapi("multiroom:SlaveKickout:{0}".format(self._host), None)
+            players = [master, self]
+        else:
+            players = [self] + self.group_slaves
+            if len(players) == 1:
+                return
+            value = await self.call_wiim_httpapi("multiroom:Ungroup", None)
+        if value != "OK":
+            _LOGGER.warning("Failed to unjoin %s, got response: %s", self.entity_id, value)
+
+        await self.async_confirm_group(lambda: all(device.group_master is None for device in players[1:]), players)
+
+    async def async_confirm_group(self, confirmed, players):
+        """Poll players together until confirmed() holds or GROUP_CONFIRM_TIMEOUT passes."""
+        deadline = time.monotonic() + GROUP_CONFIRM_TIMEOUT
+        while True:
+            await asyncio.sleep(GROUP_CONFIRM_INTERVAL)
+            for device in players:
+                device.invalidate_update()
+            await asyncio.gather(*[device.async_update_ha_state(True) for device in players])
+            if confirmed():
+                return True
+            if time.monotonic() >= deadline:
+                _LOGGER.warning("Multiroom group change of %s not confirmed by the players", self.entity_id)
+                return False
+
+    async def async_set_group_volume(self, volume):
+        """Set all players of the group of this player to volume level (0..1) at once."""
+        master = self.group_master or self
+        players = [device for device in [master] + master.group_slaves if device._fixed_volume != '1']
+        target = round(volume * MAX_VOL)
+        for device in players:
+            await self.hass.data[DOMAIN].fader.async_cancel(device)
+        results = await asyncio.gather(*[device.async_write_volume(target) for device in players])
+        if not all(results):
+            _LOGGER.warning("Group volume of %s not set on all players", master.entity_id)
 				
 		
     async def async_execute_command(self, command, notif):
@@ -1285,9 +1989,19 @@ class WiiMDevice(MediaPlayerEntity):
         if command == 'rescan':
             self._unav_throttle = False
             self._first_update = True
+            self._force_probe = True
+            self._slow_lane_at = None
+            self.hass.data[DOMAIN].browse_cache.clear()
             value = "Scheduled to Rescan"
         elif command == 'reboot':
             value = await self.call_wiim_httpapi("reboot", None)
+            self._force_probe = True
+        elif command == 'watchdog_on':
+            self.hass.data[DOMAIN].watchdog.start(self.hass.loop)
+            value = "Event loop watchdog started"
+        elif command == 'watchdog_off':
+            self.hass.data[DOMAIN].watchdog.stop()
+            value = "Event loop watchdog stopped"
         else:
             value = "No such command implemented."
             _LOGGER.warning("Player %s command: %s, result: %s", self.entity_id, command, value)
@@ -1302,7 +2016,6 @@ class WiiMDevice(MediaPlayerEntity):
 		
     async def async_update_via_upnp(self):
         """Update track info via UPNP."""
-        import validators
 
         if self._player_statdata is None: #self._player_mediainfo is None:  
             return
@@ -1327,68 +2040,23 @@ class WiiMDevice(MediaPlayerEntity):
         if media_metadata is None:
             return
 
-        try:
-            parser = ET.XMLParser(recover=True)
-            xml_tree = ET.fromstring(media_metadata.encode(), parser)
-        except:
+        metadata, elapsed = await self.hass.data[DOMAIN].metadata_parser.async_parse(media_metadata)
+        self._parse_stats['count'] += 1
+        self._parse_stats['last_bytes'] = len(media_metadata)
+        self._parse_stats['last_ms'] = round(elapsed * 1000, 2)
+        self._parse_stats['max_ms'] = max(self._parse_stats['max_ms'], self._parse_stats['last_ms'])
+        if metadata is None:
             _LOGGER.warning("XML parse error for %s, %s", media_metadata, self.entity_id)
             return
 
-        xml_path = "{urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/}item/"
-        title_xml_path = "{http://purl.org/dc/elements/1.1/}title"
-        artist_xml_path = "{urn:schemas-upnp-org:metadata-1-0/upnp/}artist"
-        album_xml_path = "{urn:schemas-upnp-org:metadata-1-0/upnp/}album"
-        image_xml_path = "{urn:schemas-upnp-org:metadata-1-0/upnp/}albumArtURI"
-        rate_hz_xml_path = "{www.wiimu.com/song/}rate_hz"
-        format_s_xml_path = "{www.wiimu.com/song/}format_s"
-        bitrate_xml_path = "{www.wiimu.com/song/}bitrate"
-
-        title_node = xml_tree.find("{0}{1}".format(xml_path, title_xml_path))
-        artist_node = xml_tree.find("{0}{1}".format(xml_path, artist_xml_path))
-        album_node = xml_tree.find("{0}{1}".format(xml_path, album_xml_path))
-        image_url_node = xml_tree.find("{0}{1}".format(xml_path, image_xml_path))
-        rate_hz_node = xml_tree.find("{0}{1}".format(xml_path, rate_hz_xml_path))
-        format_s_node = xml_tree.find("{0}{1}".format(xml_path, format_s_xml_path))
-        bitrate_node = xml_tree.find("{0}{1}".format(xml_path, bitrate_xml_path))
-
-        if rate_hz_node is None:
-            rate_hz_node_a = xml_tree.xpath("//*[local-name()='song:rate_hz']")
-            if len(rate_hz_node_a or []) > 0:
-                rate_hz_node = rate_hz_node_a[0]    
-
-        if format_s_node is None:
-            format_s_node_a = xml_tree.xpath("//*[local-name()='song:format_s']")
-            if len(format_s_node_a or []) > 0:
-                format_s_node = format_s_node_a[0] 
-
-        if bitrate_node is None:
-            bitrate_node_a = xml_tree.xpath("//*[local-name()='song:bitrate']")		
-            if len(bitrate_node_a or []) > 0:
-                bitrate_node = bitrate_node_a[0] 			
-
-        if title_node is not None:
-            self._media_title = title_node.text
-        if artist_node is not None:
-            self._media_artist = artist_node.text
-        if album_node is not None:
-            self._media_album = album_node.text
-        if image_url_node is not None:
-            self._media_image_url = image_url_node.text
-        if rate_hz_node is not None:
-            self._samplerate = rate_hz_node.text
-        if format_s_node is not None:
-            self._bitdepth = format_s_node.text
-        if bitrate_node is not None:
-            self._bitrate = bitrate_node.text
-
-        if self._media_image_url is not None:
-            if not validators.url(self._media_image_url):
-                self._media_image_url = None    
-	
+        self._media_title = metadata['title']
+        self._media_artist = metadata['artist']
+        self._media_album = metadata['album']
+        self._media_image_url = metadata['image_url']
+        self._samplerate = metadata['samplerate']
+        self._bitdepth = metadata['bitdepth']
+        self._bitrate = metadata['bitrate']
+
     async def async_browse_media(self, media_content_type=None, media_content_id=None):
         """Implement the websocket media browsing helper."""
-        return await media_source.async_browse_media(
-            self.hass,
-            media_content_id,
-            content_filter=lambda item: item.media_content_type.startswith("audio/"),
-        )		
\ No newline at end of file
+        return await self.hass.data[DOMAIN].browse_cache.async_browse(media_content_id)		
\ No newline at end of file
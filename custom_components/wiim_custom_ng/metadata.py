@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import time
+
+from lxml import etree as ET
+
+from .const import *
+
+_LOGGER = logging.getLogger(__name__)
+
+XML_PATH = "{urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/}item/"
+TITLE_XML_PATH = "{http://purl.org/dc/elements/1.1/}title"
+ARTIST_XML_PATH = "{urn:schemas-upnp-org:metadata-1-0/upnp/}artist"
+ALBUM_XML_PATH = "{urn:schemas-upnp-org:metadata-1-0/upnp/}album"
+IMAGE_XML_PATH = "{urn:schemas-upnp-org:metadata-1-0/upnp/}albumArtURI"
+RATE_HZ_XML_PATH = "{www.wiimu.com/song/}rate_hz"
+FORMAT_S_XML_PATH = "{www.wiimu.com/song/}format_s"
+BITRATE_XML_PATH = "{www.wiimu.com/song/}bitrate"
+
+
+def parse_track_metadata(media_metadata):
+    """Parse DIDL-Lite track metadata, return None if it is not XML at all."""
+    import validators
+
+    try:
+        parser = ET.XMLParser(recover=True)
+        xml_tree = ET.fromstring(media_metadata.encode(), parser)
+    except:
+        return None
+    if xml_tree is None:
+        return None
+
+    title_node = xml_tree.find("{0}{1}".format(XML_PATH, TITLE_XML_PATH))
+    artist_node = xml_tree.find("{0}{1}".format(XML_PATH, ARTIST_XML_PATH))
+    album_node = xml_tree.find("{0}{1}".format(XML_PATH, ALBUM_XML_PATH))
+    image_url_node = xml_tree.find("{0}{1}".format(XML_PATH, IMAGE_XML_PATH))
+    rate_hz_node = xml_tree.find("{0}{1}".format(XML_PATH, RATE_HZ_XML_PATH))
+    format_s_node = xml_tree.find("{0}{1}".format(XML_PATH, FORMAT_S_XML_PATH))
+    bitrate_node = xml_tree.find("{0}{1}".format(XML_PATH, BITRATE_XML_PATH))
+
+    if rate_hz_node is None:
+        rate_hz_node_a = xml_tree.xpath("//*[local-name()='song:rate_hz']")
+        if len(rate_hz_node_a or []) > 0:
+            rate_hz_node = rate_hz_node_a[0]
+
+    if format_s_node is None:
+        format_s_node_a = xml_tree.xpath("//*[local-name()='song:format_s']")
+        if len(format_s_node_a or []) > 0:
+            format_s_node = format_s_node_a[0]
+
+    if bitrate_node is None:
+        bitrate_node_a = xml_tree.xpath("//*[local-name()='song:bitrate']")
+        if len(bitrate_node_a or []) > 0:
+            bitrate_node = bitrate_node_a[0]
+
+    def text(node):
+        return node.text if node is not None else None
+
+    image_url = text(image_url_node)
+    if image_url is not None and not validators.url(image_url):
+        image_url = None
+
+    return {
+        'title': text(title_node),
+        'artist': text(artist_node),
+        'album': text(album_node),
+        'image_url': image_url,
+        'samplerate': text(rate_hz_node),
+        'bitdepth': text(format_s_node),
+        'bitrate': text(bitrate_node),
+    }
+
+
+class MetadataParser:
+    """Parse small metadata on the event loop and large payloads in the executor."""
+
+    def __init__(self, inline_max=XML_INLINE_MAX_BYTES, concurrency=XML_PARSE_CONCURRENCY):
+        """Initialize the parser."""
+        self._inline_max = inline_max
+        self._limit = asyncio.Semaphore(concurrency)
+        self.inline = 0
+        self.offloaded = 0
+
+    async def async_parse(self, media_metadata):
+        """Return (parsed metadata or None, parse time in seconds)."""
+        if len(media_metadata) <= self._inline_max:
+            self.inline += 1
+            started = time.perf_counter()
+            return parse_track_metadata(media_metadata), time.perf_counter() - started
+
+        # Bounded, so many players changing tracks together can't flood the executor.
+        async with self._limit:
+            self.offloaded += 1
+            started = time.perf_counter()
+            result = await asyncio.get_running_loop().run_in_executor(None, parse_track_metadata, media_metadata)
+            return result, time.perf_counter() - started
@@ -0,0 +1,54 @@
+STATE_IDLE = 'idle'
+STATE_PLAYING = 'playing'
+
+SWITCH_TO_WIFI = "setPlayerCmd:switchmode:wifi"
+
+# A plan takes a player from its known state to a target state with as few HTTP API
+# calls as possible. It is a list of stages, each a list of commands. Stages run in
+# order, the commands of one stage don't depend on each other and go out together.
+
+
+def _with_volume(plan, volume):
+    # The volume doesn't depend on the mode or on what plays, it goes out with the first stage.
+    if volume is None:
+        return plan
+    command = "setPlayerCmd:vol:{0}".format(int(volume))
+    if not plan:
+        return [[command]]
+    return [plan[0] + [command]] + plan[1:]
+
+
+def _leave_connect(current):
+    # A Connect session only lets go after switching back to wifi mode.
+    # The switch stops the output by itself, so the pause sent before it is not needed.
+    if current.get('connect'):
+        return [[SWITCH_TO_WIFI]]
+    return []
+
+
+def plan_stop(current):
+    """Plan stopping playback."""
+    if current.get('state') == STATE_IDLE and not (current.get('connect') or current.get('liveinput') or current.get('stream')):
+        return []
+    if current.get('liveinput') or current.get('stream'):
+        # Live inputs, and casts like AirPlay, DLNA or Chromecast, only end with the switch to wifi.
+        return [[SWITCH_TO_WIFI], ["setPlayerCmd:stop"]]
+    return _leave_connect(current) + [["setPlayerCmd:stop"]]
+
+
+def plan_play(current, command, volume=None):
+    """Plan playing a resolved play/playlist command, optionally at volume (0..100)."""
+    # play: and playlist: replace whatever is playing, pausing first only delays the audio.
+    return _with_volume(_leave_connect(current) + [["setPlayerCmd:{0}".format(command)]], volume)
+
+
+def plan_source(current, source, volume=None):
+    """Plan switching to an input source, optionally at volume (0..100)."""
+    if current.get('source') == source and current.get('state') == STATE_PLAYING:
+        return _with_volume([], volume)
+    return _with_volume(_leave_connect(current) + [["setPlayerCmd:switchmode:{0}".format(source)]], volume)
+
+
+def plan_size(plan):
+    """Return the number of commands in plan."""
+    return sum(len(stage) for stage in plan)
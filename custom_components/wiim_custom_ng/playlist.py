@@ -0,0 +1,126 @@
+import asyncio
+import async_timeout
+import logging
+import re
+from urllib.parse import urljoin, urlparse
+
+import aiohttp
+from http import HTTPStatus
+
+from .cache import TTLCache
+from .const import *
+
+_LOGGER = logging.getLogger(__name__)
+
+PLS_FILE_RE = re.compile(r'^File(\d+)=(.+)$', re.IGNORECASE)
+HLS_BANDWIDTH_RE = re.compile(r'[:,]BANDWIDTH=(\d+)')
+
+
+class PlaylistResolver:
+    """Resolve M3U, PLS and HLS playlists to a play or playlist command for the player."""
+
+    def __init__(self, limiter):
+        """Initialize the resolver."""
+        self._limiter = limiter
+        self._cache = TTLCache(PLAYLIST_CACHE_TTL, PLAYLIST_CACHE_SIZE)
+
+    async def async_resolve(self, session, url):
+        """Return ('play', stream_url), ('playlist', playlist_url) or None if url is not playable.
+
+        A single stream is played directly, so the player does not have to download the
+        playlist again. Plain or extended M3Us with several entries are handed to the
+        player as a playlist.
+        """
+        resolved = self._cache.get(url)
+        if resolved is not None:
+            return resolved
+
+        try:
+            async with self._limiter.slot(urlparse(url).hostname):
+                async with async_timeout.timeout(PLAYLIST_TIMEOUT):
+                    async with session.get(url, ssl=False) as response:
+                        if response.status != HTTPStatus.OK:
+                            _LOGGER.error("Playlist %s get failed, response code: %s", url, response.status)
+                            return None
+                        resolved = await self._async_parse(response, url)
+        except (asyncio.TimeoutError, aiohttp.ClientError) as error:
+            _LOGGER.warning("Unable to get the playlist %s: %s", url, type(error))
+            return None
+
+        if resolved is None:
+            _LOGGER.error("Playlist %s: no playable entries found", url)
+            return None
+
+        _LOGGER.debug("Playlist %s resolved to %s", url, resolved)
+        self._cache.set(url, resolved)
+        return resolved
+
+    def invalidate(self, url):
+        """Forget a cached resolution, e.g. after the player refused it."""
+        self._cache.pop(url)
+
+    async def _async_lines(self, response, url):
+        # Lines are split here: iterating the reader itself raises on a line longer than
+        # its limit, e.g. when the URL serves audio instead of a playlist.
+        read = 0
+        pending = b''
+        async for chunk in response.content.iter_chunked(4096):
+            read += len(chunk)
+            if read > PLAYLIST_MAX_BYTES:
+                _LOGGER.debug("Playlist %s larger than %s bytes, using the first part", url, PLAYLIST_MAX_BYTES)
+                return
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line
+        yield pending
+
+    async def _async_parse(self, response, url):
+        kind = None
+        entries = []
+        variants = []
+        stream_inf = None
+
+        async for raw in self._async_lines(response, url):
+            line = raw.decode('utf-8', errors='replace').strip().lstrip('\ufeff')
+            if not line:
+                continue
+
+            if kind is None:
+                kind = 'pls' if line.lower() == '[playlist]' else 'm3u'
+
+            if kind == 'pls':
+                match = PLS_FILE_RE.match(line)
+                if match:
+                    entries.append((int(match.group(1)), match.group(2).strip()))
+                    if match.group(1) == '1':
+                        break
+                continue
+
+            if line.startswith('#EXT-X-STREAM-INF'):
+                match = HLS_BANDWIDTH_RE.search(line)
+                stream_inf = int(match.group(1)) if match else 0
+                continue
+            if line.startswith('#EXT-X-TARGETDURATION') or line.startswith('#EXT-X-MEDIA-SEQUENCE'):
+                # HLS media playlist, the player streams it as it is.
+                return ('play', url)
+            if line.startswith('#'):
+                continue
+
+            entry = urljoin(url, line)
+            if stream_inf is not None:
+                variants.append((stream_inf, entry))
+                stream_inf = None
+            elif entry.startswith('http'):
+                entries.append((len(entries) + 1, entry))
+                if len(entries) > 1 and not variants:
+                    break
+
+        if variants:
+            # HLS master playlist, take the richest variant.
+            return ('play', max(variants)[1])
+        if not entries:
+            return None
+        if kind == 'pls' or len(entries) == 1:
+            return ('play', min(entries)[1])
+        return ('playlist', url)
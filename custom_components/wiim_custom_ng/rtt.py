@@ -0,0 +1,50 @@
+from .const import *
+
+
+class RttEstimator:
+    """Round-trip time estimate of one endpoint, timeouts derived like a TCP RTO (RFC 6298)."""
+
+    def __init__(self, initial, min_timeout, max_timeout):
+        """Initialize the estimator, initial is used until the first sample."""
+        self._initial = initial
+        self._min = min_timeout
+        self._max = max_timeout
+        self.srtt = None
+        self.rttvar = None
+        self.samples = 0
+        self.timeouts = 0
+        self._backoff = 1
+
+    def add_sample(self, rtt):
+        """Take in the round-trip time of a successful request."""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - RTT_BETA) * self.rttvar + RTT_BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - RTT_ALPHA) * self.srtt + RTT_ALPHA * rtt
+        self.samples += 1
+        self._backoff = 1
+
+    def add_timeout(self):
+        """Note a request that timed out, the next timeout is doubled until a sample comes in."""
+        self.timeouts += 1
+        self._backoff = min(self._backoff * 2, 64)
+
+    def timeout(self):
+        """Return the timeout for the next request."""
+        if self.srtt is None:
+            rto = self._initial
+        else:
+            rto = self.srtt + max(RTT_GRANULARITY, RTT_K * self.rttvar)
+        return min(max(rto * self._backoff, self._min), self._max)
+
+    def as_dict(self):
+        """Return the estimate for diagnostics."""
+        return {
+            'srtt_ms': round(self.srtt * 1000, 1) if self.srtt is not None else None,
+            'rttvar_ms': round(self.rttvar * 1000, 1) if self.rttvar is not None else None,
+            'timeout_ms': round(self.timeout() * 1000, 1),
+            'samples': self.samples,
+            'timeouts': self.timeouts,
+        }
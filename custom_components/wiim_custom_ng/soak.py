@@ -0,0 +1,488 @@
+"""Soak the protocol code against simulated players and fail on resource growth.
+
+python -m custom_components.wiim_custom_ng.soak [--players 20] [--duration 300] [--watchdog MS] [--json]
+
+Days of polling, outages, reloads and commands are compressed into minutes. RSS,
+tracemalloc, open sockets and pending asyncio tasks are sampled while it runs. With
+--watchdog it also fails when a hot path blocks the event loop for longer than MS.
+
+Run it from the configuration directory. Home Assistant isn't needed, only aiohttp and the
+requirements in manifest.json (async-upnp-client, lxml, validators).
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from xml.sax.saxutils import escape as xml_escape
+
+import aiohttp
+from aiohttp import web
+
+from .client import WiiMClient, WiiMState
+from .limiter import TrafficLimiter
+from .metadata import MetadataParser
+from .planner import plan_play, plan_source, plan_stop
+from .upnp import UpnpPool
+from .watchdog import LoopWatchdog
+
+METRICS = ['rss_kb', 'traced_kb', 'sockets', 'tasks']
+# Growth that is tolerated between the first and the last window, (relative, absolute).
+# The absolute part covers caches of aiohttp, yarl and importlib filling up to their bounds.
+GROWTH_TOLERANCE = {'rss_kb': (0.10, 8192), 'traced_kb': (0.10, 2048), 'sockets': (0, 2), 'tasks': (0, 2)}
+
+AVTRANSPORT = 'urn:schemas-upnp-org:service:AVTransport:1'
+RENDERING_CONTROL = 'urn:schemas-upnp-org:service:RenderingControl:1'
+# The actions polled by the integration and their out arguments.
+UPNP_SERVICES = {
+    'AVTransport': (AVTRANSPORT, {
+        'GetInfoEx': [
+            ('CurrentTransportState', 'string'), ('PlayType', 'string'), ('LoopMode', 'ui4'),
+            ('CurrentVolume', 'ui4'), ('TrackDuration', 'string'), ('RelTime', 'string'),
+            ('Track', 'ui4'), ('SlaveFlag', 'ui4'), ('MasterUUID', 'string'), ('TrackURI', 'string'),
+            ('TrackSource', 'string'), ('TrackMetaData', 'string'),
+        ],
+        'GetMediaInfo': [('NrTracks', 'ui4')],
+    }),
+    'RenderingControl': (RENDERING_CONTROL, {
+        'GetControlDeviceInfo': [('CurrentMute', 'ui4')],
+    }),
+}
+SCPD_ARGUMENT = (
+    '<argument><name>{0}</name><direction>{1}</direction>'
+    '<relatedStateVariable>{0}</relatedStateVariable></argument>'
+)
+SOAP_RESPONSE = (
+    '<?xml version="1.0"?><s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+    's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body>'
+    '<u:{0}Response xmlns:u="{1}">{2}</u:{0}Response></s:Body></s:Envelope>'
+)
+
+
+def scpd_xml(actions):
+    """Return the service description of actions taking an InstanceID."""
+    variables = {'InstanceID': 'ui4'}
+    action_list = []
+    for action, outs in actions.items():
+        arguments = [SCPD_ARGUMENT.format('InstanceID', 'in')]
+        for name, data_type in outs:
+            variables[name] = data_type
+            arguments.append(SCPD_ARGUMENT.format(name, 'out'))
+        action_list.append('<action><name>{0}</name><argumentList>{1}</argumentList></action>'.format(action, ''.join(arguments)))
+    state_table = ''.join(
+        '<stateVariable sendEvents="no"><name>{0}</name><dataType>{1}</dataType></stateVariable>'.format(name, data_type)
+        for name, data_type in variables.items()
+    )
+    return (
+        '<?xml version="1.0"?><scpd xmlns="urn:schemas-upnp-org:service-1-0">'
+        '<specVersion><major>1</major><minor>0</minor></specVersion>'
+        '<actionList>{0}</actionList><serviceStateTable>{1}</serviceStateTable></scpd>'
+    ).format(''.join(action_list), state_table)
+
+
+class SimulatedPlayer:
+    """HTTP API and UPnP services of a player, served on localhost, that can be taken offline."""
+
+    def __init__(self, index):
+        """Initialize the player, start() picks the port."""
+        self.index = index
+        self.port = None
+        self.requests = 0
+        self._runner = None
+        self._track = 0
+        self._status = 'play'
+
+    @property
+    def host(self):
+        """Return host:port of the player."""
+        return "127.0.0.1:{0}".format(self.port)
+
+    @property
+    def uuid(self):
+        """Return the getStatusEx uuid of the player."""
+        return "FF{0:022X}".format(self.index)
+
+    async def start(self):
+        """Bring the player online, on the same port as before if it was online already."""
+        app = web.Application()
+        app.router.add_get('/httpapi.asp', self._handle)
+        app.router.add_get('/description.xml', self._handle_description)
+        app.router.add_get('/upnp/{service}.xml', self._handle_scpd)
+        app.router.add_post('/upnp/control/{service}', self._handle_control)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', self.port or 0)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self):
+        """Take the player offline."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _next_status(self):
+        # A new track every few polls, with a title long enough to matter.
+        if random.random() < 0.1:
+            self._track += 1
+        return {
+            'title': "Track {0} {1}".format(self._track, 'x' * random.randint(10, 2000)),
+            'artist': "Artist {0}".format(self._track),
+            'album': "Album",
+            'loop': random.choice([0, 1, 2, 3, 4]),
+            'volume': random.randint(0, 100),
+            'position': random.randint(0, 200000),
+        }
+
+    async def _handle(self, request):
+        self.requests += 1
+        command = request.query.get('command', '')
+        if command == 'getStatusEx':
+            return web.json_response({
+                'uuid': self.uuid,
+                'DeviceName': "Soak {0}".format(self.index),
+                'firmware': 'Linkplay.4.6.425351',
+                'project': 'WiiM_Pro_with_gc4a',
+                'plm_support': '0x40012',
+                'preset_key': '12',
+                'volume_control': '0',
+            })
+        if command == 'getPlayerStatus':
+            status = self._next_status()
+            return web.json_response({
+                'status': self._status,
+                'mode': '10',
+                'loop': str(status['loop']),
+                'vol': str(status['volume']),
+                'mute': '0',
+                'curpos': str(status['position']),
+                'totlen': '200000',
+                'plicurr': str(self._track),
+                'plicount': '50',
+                'Title': status['title'].encode().hex(),
+                'Artist': status['artist'].encode().hex(),
+                'Album': status['album'].encode().hex(),
+            })
+        if command.startswith('setPlayerCmd:stop'):
+            self._status = 'stop'
+        elif command.startswith('setPlayerCmd:'):
+            self._status = 'play'
+        return web.Response(text='OK')
+
+    async def _handle_description(self, request):
+        self.requests += 1
+        services = ''.join(
+            '<service><serviceType>{0}</serviceType><serviceId>urn:upnp-org:serviceId:{1}</serviceId>'
+            '<SCPDURL>/upnp/{1}.xml</SCPDURL><controlURL>/upnp/control/{1}</controlURL>'
+            '<eventSubURL>/upnp/event/{1}</eventSubURL></service>'.format(service_type, name)
+            for name, (service_type, _) in UPNP_SERVICES.items()
+        )
+        return web.Response(content_type='text/xml', text=(
+            '<?xml version="1.0"?><root xmlns="urn:schemas-upnp-org:device-1-0">'
+            '<specVersion><major>1</major><minor>0</minor></specVersion><device>'
+            '<deviceType>urn:schemas-upnp-org:device:MediaRenderer:1</deviceType>'
+            '<friendlyName>Soak {0}</friendlyName><manufacturer>Linkplay Technology Inc.</manufacturer>'
+            '<modelName>WiiM Pro</modelName><modelNumber>WiiM_Pro_with_gc4a</modelNumber>'
+            '<softwareVersion>Linkplay.4.6.425351</softwareVersion><UDN>uuid:{1}</UDN>'
+            '<serviceList>{2}</serviceList></device></root>'
+        ).format(self.index, self.uuid, services))
+
+    async def _handle_scpd(self, request):
+        self.requests += 1
+        service = UPNP_SERVICES.get(request.match_info['service'])
+        if service is None:
+            raise web.HTTPNotFound()
+        return web.Response(content_type='text/xml', text=scpd_xml(service[1]))
+
+    async def _handle_control(self, request):
+        self.requests += 1
+        service_type, _ = UPNP_SERVICES[request.match_info['service']]
+        await request.read()
+        action = request.headers.get('SOAPACTION', '').strip('"').split('#')[-1]
+        if action == 'GetInfoEx':
+            status = self._next_status()
+            metadata = (
+                '<DIDL-Lite xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/" '
+                'xmlns:dc="http://purl.org/dc/elements/1.1/" '
+                'xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/"><item>'
+                '<dc:title>{0}</dc:title><upnp:artist>{1}</upnp:artist><upnp:album>{2}</upnp:album>'
+                '</item></DIDL-Lite>'
+            ).format(xml_escape(status['title']), xml_escape(status['artist']), xml_escape(status['album']))
+            values = {
+                'CurrentTransportState': 'PLAYING' if self._status == 'play' else 'STOPPED',
+                'PlayType': '10',
+                'LoopMode': status['loop'],
+                'CurrentVolume': status['volume'],
+                'TrackDuration': '0:03:20',
+                'RelTime': '0:01:00',
+                'Track': self._track,
+                'SlaveFlag': 0,
+                'MasterUUID': '',
+                'TrackURI': "http://127.0.0.1/{0}.mp3".format(self._track),
+                'TrackSource': 'Soak',
+                'TrackMetaData': metadata,
+            }
+        elif action == 'GetMediaInfo':
+            values = {'NrTracks': 50}
+        elif action == 'GetControlDeviceInfo':
+            values = {'CurrentMute': 0}
+        else:
+            raise web.HTTPInternalServerError()
+        body = ''.join('<{0}>{1}</{0}>'.format(name, xml_escape(str(value))) for name, value in values.items())
+        return web.Response(content_type='text/xml', text=SOAP_RESPONSE.format(action, service_type, body))
+
+
+def sample_metrics():
+    """Return the current resource usage of this process."""
+    try:
+        with open('/proc/self/statm') as file:
+            rss_kb = int(file.read().split()[1]) * resource.getpagesize() // 1024
+    except OSError:
+        rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    sockets = 0
+    try:
+        fds = os.listdir('/proc/self/fd')
+    except OSError:
+        fds = []
+    for fd in fds:
+        try:
+            # The fd of the listing itself is already closed here.
+            if os.readlink('/proc/self/fd/' + fd).startswith('socket:'):
+                sockets += 1
+        except OSError:
+            pass
+    return {
+        'time': time.monotonic(),
+        'rss_kb': rss_kb,
+        'traced_kb': tracemalloc.get_traced_memory()[0] // 1024,
+        'sockets': sockets,
+        'tasks': len(asyncio.all_tasks()),
+    }
+
+
+def find_growth(samples, windows=5, warmup=30):
+    """Return the metrics growing from window to window by more than the tolerance.
+
+    Samples of the first warmup seconds are left out, caches fill up and imports finish there.
+    """
+    if not samples:
+        return []
+    samples = [sample for sample in samples if sample['time'] - samples[0]['time'] >= warmup]
+    size = len(samples) // windows
+    if size == 0:
+        return []
+    growing = []
+    for metric in METRICS:
+        means = [sum(s[metric] for s in samples[i * size:(i + 1) * size]) / size for i in range(windows)]
+        monotonic = all(later > earlier for earlier, later in zip(means, means[1:]))
+        relative, absolute = GROWTH_TOLERANCE[metric]
+        limit = max(means[0] * (1 + relative), means[0] + absolute)
+        if monotonic and means[-1] > limit:
+            growing.append(metric)
+    return growing
+
+
+class Soak:
+    """Drive WiiMClients against simulated players like the integration would, only faster."""
+
+    def __init__(self, players, interval, outage_rate, reload_interval, watchdog=None):
+        """Initialize the soak, watchdog is the threshold in seconds for blocking the loop."""
+        self.players = [SimulatedPlayer(index) for index in range(players)]
+        self.interval = interval
+        self.outage_rate = outage_rate
+        self.reload_interval = reload_interval
+        self.polls = 0
+        self.commands = 0
+        self.outages = 0
+        self.reloads = 0
+        self.upnp_devices = 0
+        self.parser = MetadataParser()
+        # The simulated players and the sampling live in here, only the integration's own frames count.
+        self.watchdog = LoopWatchdog(watchdog, exclude=[os.path.abspath(__file__)]) if watchdog else None
+        self._session = None
+        self._upnp = None
+        self._clients = []
+        self._devices = {}
+
+    async def async_reload(self):
+        """Drop all clients and shared state and create them anew, like an entry reload."""
+        if self._session is not None:
+            await self._session.close()
+        if self._upnp is not None:
+            await self._upnp.async_close()
+        self._session = aiohttp.ClientSession()
+        self._upnp = UpnpPool()
+        limiter = TrafficLimiter(rate=1000, burst=100)
+        self._clients = [
+            WiiMClient(
+                self._session, player.host, limiter, self._upnp, base_url="http://" + player.host,
+                description_url="http://{0}/description.xml".format(player.host))
+            for player in self.players
+        ]
+        self._devices = {}
+        self.reloads += 1
+
+    async def _async_status_via_upnp(self, index, client):
+        # Like the entity: the device is dropped on any failure and created anew afterwards.
+        device = self._devices.get(index)
+        if device is None:
+            device = await client.async_create_upnp_device()
+            if device is None:
+                return None
+            self._devices[index] = device
+            self.upnp_devices += 1
+        try:
+            transport = device.service(AVTRANSPORT)
+            statdata = await client.async_upnp_action(transport, "GetInfoEx")
+            deviceinfo = await client.async_upnp_action(device.service(RENDERING_CONTROL), "GetControlDeviceInfo")
+            mediainfo = await client.async_upnp_action(transport, "GetMediaInfo")
+        except Exception:
+            self._devices.pop(index, None)
+            return None
+        return statdata, deviceinfo, mediainfo
+
+    async def _async_poll(self, index, client, prev):
+        status = await self._async_status_via_upnp(index, client)
+        if status is None:
+            status = await client.async_player_status(prev)
+        self.polls += 1
+        if status is None:
+            return prev
+        state = WiiMState(*status)
+        if state.metadata:
+            await self.parser.async_parse(state.metadata)
+        return status[0]
+
+    async def _async_command(self, client):
+        current = {'state': 'playing', 'connect': random.random() < 0.2, 'source': None}
+        plan = random.choice([
+            plan_stop(current),
+            plan_play(current, "play:http://127.0.0.1/stream.mp3"),
+            plan_source(current, 'line-in'),
+            [["setPlayerCmd:vol:{0}".format(random.randint(0, 100))]],
+        ])
+        await client.async_run_plan(plan)
+        self.commands += 1
+
+    async def _async_outage(self, player):
+        self.outages += 1
+        await player.stop()
+        await asyncio.sleep(random.uniform(self.interval, self.interval * 20))
+        await player.start()
+
+    async def async_run(self, duration, sample_interval):
+        """Run for duration seconds, return the samples."""
+        for player in self.players:
+            await player.start()
+        await self.async_reload()
+        if self.watchdog is not None:
+            self.watchdog.start(asyncio.get_running_loop())
+
+        samples = []
+        prev = {}
+        outages = set()
+        started = time.monotonic()
+        next_sample = started
+        next_reload = started + self.reload_interval
+        while time.monotonic() - started < duration:
+            clients = self._clients
+            jobs = []
+            for player, client in zip(self.players, clients):
+                jobs.append(self._async_poll(player.index, client, prev.get(player.index)))
+            statuses = await asyncio.gather(*jobs)
+            prev = {player.index: status for player, status in zip(self.players, statuses)}
+
+            await asyncio.gather(*[self._async_command(client) for client in clients if random.random() < 0.2])
+
+            for player in self.players:
+                if player.index not in outages and random.random() < self.outage_rate:
+                    outages.add(player.index)
+                    task = asyncio.ensure_future(self._async_outage(player))
+                    task.add_done_callback(lambda _, index=player.index: outages.discard(index))
+
+            now = time.monotonic()
+            if now >= next_reload:
+                await self.async_reload()
+                next_reload = now + self.reload_interval
+            if now >= next_sample:
+                gc.collect()
+                samples.append(sample_metrics())
+                next_sample = now + sample_interval
+            await asyncio.sleep(self.interval)
+
+        while outages:
+            await asyncio.sleep(self.interval)
+        if self.watchdog is not None:
+            self.watchdog.stop()
+        await self._session.close()
+        await self._upnp.async_close()
+        for player in self.players:
+            await player.stop()
+        return samples
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='soak', description="Soak the protocol code against simulated players.")
+    parser.add_argument('--players', type=int, default=20, help="number of simulated players")
+    parser.add_argument('--duration', type=float, default=300, help="length of the soak in seconds")
+    parser.add_argument('--interval', type=float, default=0.05, help="seconds between poll rounds")
+    parser.add_argument('--outage-rate', type=float, default=0.002, help="chance of a player going offline per round")
+    parser.add_argument('--reload-interval', type=float, default=30, help="seconds between simulated entry reloads")
+    parser.add_argument('--sample-interval', type=float, default=2, help="seconds between resource samples")
+    parser.add_argument('--warmup', type=float, default=30, help="seconds of samples left out of the growth check")
+    parser.add_argument('--watchdog', type=float, metavar='MS', help="fail if the integration blocks the event loop for longer than MS")
+    parser.add_argument('--json', action='store_true', help="print JSON instead of a summary")
+    args = parser.parse_args(argv)
+
+    # Outages make the client warn on every poll of an offline player.
+    logging.basicConfig(level=logging.ERROR)
+    if not args.watchdog:
+        # Tracing every allocation slows the loop down too much for the watchdog.
+        tracemalloc.start(10)
+    soak = Soak(args.players, args.interval, args.outage_rate, args.reload_interval, args.watchdog / 1000 if args.watchdog else None)
+    samples = asyncio.run(soak.async_run(args.duration, args.sample_interval))
+    growing = find_growth(samples, warmup=args.warmup)
+    top = []
+    if tracemalloc.is_tracing():
+        top = [str(stat) for stat in tracemalloc.take_snapshot().statistics('lineno')[:10]]
+        tracemalloc.stop()
+
+    result = {
+        'polls': soak.polls,
+        'commands': soak.commands,
+        'outages': soak.outages,
+        'reloads': soak.reloads,
+        'upnp_devices': soak.upnp_devices,
+        'samples': samples,
+        'top_allocators': top,
+        'growing': growing,
+        'watchdog': soak.watchdog.as_dict() if soak.watchdog is not None else None,
+    }
+    stalls = soak.watchdog.stalls if soak.watchdog is not None else 0
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print("{0} polls, {1} commands, {2} outages, {3} reloads, {4} UPnP devices created".format(
+            soak.polls, soak.commands, soak.outages, soak.reloads, soak.upnp_devices))
+        for metric in METRICS:
+            print("{0:10} {1:>10} -> {2:>10}".format(metric, samples[0][metric], samples[-1][metric]) if samples else metric)
+        print("Top allocators:")
+        for line in top:
+            print("  " + line)
+        print("Growing: " + (', '.join(growing) or 'nothing'))
+        if soak.watchdog is not None:
+            print("Event loop blocked longer than {0} ms: {1} times, at most {2} ms".format(
+                args.watchdog, stalls, int(soak.watchdog.max_stall * 1000)))
+            for sample in soak.watchdog.samples:
+                print(sample['stack'])
+    return 1 if growing or stalls else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
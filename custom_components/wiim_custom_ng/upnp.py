@@ -0,0 +1,96 @@
+import logging
+from urllib.parse import urlparse
+
+import aiohttp
+
+from async_upnp_client.aiohttp import AiohttpSessionRequester
+from async_upnp_client.client import UpnpRequester
+from async_upnp_client.client_factory import UpnpFactory
+
+from .const import *
+from .discovery import parse_description
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class TemplateRequester(UpnpRequester):
+    """Requester sharing fetched SCPDs between devices of the same model and firmware.
+
+    Only the public requester interface is used: the description of a host gives the
+    template key, the service descriptions fetched from that host afterwards are kept
+    under it.
+    """
+
+    def __init__(self, requester):
+        """Initialize the requester, requests are passed on to requester."""
+        self._requester = requester
+        self._templates = {}
+        self._host_keys = {}
+        self.template_hits = 0
+
+    async def async_http_request(self, http_request):
+        """Answer a service description GET from the templates, pass everything else on."""
+        if http_request.method != 'GET':
+            return await self._requester.async_http_request(http_request)
+
+        url = urlparse(http_request.url)
+        template_key = self._host_keys.get(url.netloc)
+        key = template_key + (url.path,) if template_key is not None else None
+        response = self._templates.get(key) if key is not None else None
+        if response is not None:
+            self.template_hits += 1
+            return response
+
+        response = await self._requester.async_http_request(http_request)
+        if response.status_code != 200 or not response.body:
+            return response
+
+        description = parse_description(response.body.encode())
+        if description is not None and description['udn']:
+            # A (re)fetched device description, also after a firmware update.
+            template_key = (description['model_name'], description['model_number'], description['software_version'])
+            if any(template_key):
+                self._host_keys[url.netloc] = template_key
+            else:
+                self._host_keys.pop(url.netloc, None)
+        elif key is not None:
+            self._templates[key] = response
+        return response
+
+
+class UpnpPool:
+    """One UPnP session, requester and factory for all players."""
+
+    def __init__(self):
+        """Initialize the pool, the session is created on first use."""
+        self._session = None
+        self._requester = None
+        self._factory = None
+
+    @property
+    def factory(self):
+        """Return the shared factory."""
+        if self._factory is None:
+            connector = aiohttp.TCPConnector(limit=UPNP_POOL_LIMIT, limit_per_host=UPNP_POOL_LIMIT_PER_HOST)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._requester = TemplateRequester(AiohttpSessionRequester(self._session, True, UPNP_TIMEOUT_MAX))
+            self._factory = UpnpFactory(self._requester)
+        return self._factory
+
+    async def async_close(self):
+        """Close the session, the next use opens a new one."""
+        if self._session is not None:
+            await self._session.close()
+        self._session = None
+        self._requester = None
+        self._factory = None
+
+    def as_dict(self):
+        """Return pool details for diagnostics."""
+        if self._factory is None:
+            return {'open': False}
+        return {
+            'open': True,
+            'templates': len(self._requester._templates),
+            'template_hits': self._requester.template_hits,
+        }
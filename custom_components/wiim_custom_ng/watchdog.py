@@ -0,0 +1,102 @@
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from .const import *
+
+_LOGGER = logging.getLogger(__name__)
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class LoopWatchdog:
+    """Opt-in detector for event loop stalls caused by this integration.
+
+    A heartbeat callback on the loop is watched from a separate thread. When the
+    heartbeat is late by more than the threshold, the stack of the loop thread is
+    sampled and, if any frame belongs to this package, logged and counted.
+    """
+
+    def __init__(self, threshold=WATCHDOG_THRESHOLD, exclude=()):
+        """Initialize the watchdog, frames in the files in exclude don't count as this package."""
+        self.threshold = threshold
+        self._exclude = set(exclude)
+        self.stalls = 0
+        self.max_stall = 0.0
+        self.samples = deque(maxlen=WATCHDOG_SAMPLES)
+        self._interval = threshold / 4
+        self._loop = None
+        self._loop_thread = None
+        self._heartbeat_handle = None
+        self._beat = 0.0
+        self._reported_beat = None
+        self._stop = None
+        self._thread = None
+
+    @property
+    def running(self):
+        """Return True while the watchdog is active."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, loop):
+        """Start watching loop, has to be called from the loop thread."""
+        if self.running:
+            return
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+        # Every run has its own event, a monitor of a previous run still sleeping can't miss its stop.
+        self._stop = threading.Event()
+        self._heartbeat()
+        self._thread = threading.Thread(target=self._monitor, args=(self._stop,), name=DOMAIN + "_watchdog", daemon=True)
+        self._thread.start()
+        _LOGGER.info("Event loop watchdog started, threshold %s ms", int(self.threshold * 1000))
+
+    def stop(self):
+        """Stop watching."""
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+        if self._heartbeat_handle is not None:
+            self._heartbeat_handle.cancel()
+            self._heartbeat_handle = None
+        self._thread = None
+
+    def as_dict(self):
+        """Return the statistics for diagnostics."""
+        return {
+            'running': self.running,
+            'threshold_ms': int(self.threshold * 1000),
+            'stalls': self.stalls,
+            'max_stall_ms': int(self.max_stall * 1000),
+            'samples': list(self.samples),
+        }
+
+    def _heartbeat(self):
+        self._beat = time.monotonic()
+        self._heartbeat_handle = self._loop.call_later(self._interval, self._heartbeat)
+
+    def _monitor(self, stop):
+        while not stop.wait(self._interval):
+            beat = self._beat
+            stall = time.monotonic() - beat - self._interval
+            if stall < self.threshold or beat == self._reported_beat:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            if not any(entry.filename.startswith(PACKAGE_DIR) and entry.filename not in self._exclude for entry in stack):
+                continue
+
+            # One report per stall, the next heartbeat starts a new one.
+            self._reported_beat = beat
+            self.stalls += 1
+            self.max_stall = max(self.max_stall, stall)
+            sample = ''.join(traceback.format_list(stack[-WATCHDOG_STACK_DEPTH:]))
+            self.samples.append({'stall_ms': int(stall * 1000), 'stack': sample})
+            _LOGGER.warning("Event loop blocked for at least %s ms in %s:\n%s", int(stall * 1000), DOMAIN, sample)